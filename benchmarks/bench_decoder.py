@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compare CPU time per frame of smllib and the fast path decoder, both resolving the
+# registers configured in config.ini, and of the fingerprint that lets unchanged
+# frames skip decoding with smllib.
+#
+# usage: python3 benchmarks/bench_decoder.py [capture.bin ...]
+
+import configparser
+import os
+import sys
+import time
+
+from sml_samples import load_captures
+
+from obis_mapping import ObisMapping, obis_to_bytes
+from sml_decoder import SmlFastDecoder, value_fingerprint
+from sml_pipeline import SmlFramePipeline
+
+
+def bench(name, frames, func, rounds):
+    start = time.process_time()
+    for i in range(rounds):
+        for frame in frames:
+            func(frame)
+    elapsed = time.process_time() - start
+    print('%-24s %10.1f us/frame' % (name, elapsed / (rounds * len(frames)) * 1e6))
+
+
+def main():
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'config.ini'))
+    mapping = ObisMapping.from_config(config)
+    identity = {obis_to_bytes(config['DEFAULT']['SmlPathSmartMeterId']): 'serial'}
+    decoder = SmlFastDecoder(mapping.byte_index, identity)
+
+    frames = list(SmlFramePipeline().feed(load_captures(sys.argv[1:])))
+    if not frames:
+        print('No frames found')
+        return
+    rounds = max(1, 20000 // len(frames))
+    print('%d frames, %d rounds' % (len(frames), rounds))
+
+    # both have to agree before their speed means anything
+    for frame in frames:
+        fast, ident = decoder.decode(frame.buffer)
+        if fast != mapping.resolve(frame.get_obis()):
+            print('Decoders disagree: %s' % fast)
+
+    bench('smllib get_obis', frames, lambda f: mapping.resolve(f.get_obis()), rounds)
+    bench('fast', frames, lambda f: decoder.decode(f.buffer), rounds)
+    bench('smllib parse_frame', frames, lambda f: f.parse_frame(), max(1, rounds // 10))
+    bench('fast with identity', frames, lambda f: decoder.decode(f.buffer, True), rounds)
+    bench('value fingerprint', frames, lambda f: value_fingerprint(f.buffer), rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Memory per meter: N emulated meters served by one driver process versus one
+# process per meter, resident set size once all of them publish.
+#
+# usage: python3 benchmarks/bench_memory.py [--meters 3] [--settle 10] [--mode poll|watch|thread] [capture.bin ...]
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from dbus_session import start_private_bus, install_driver
+from sml_replay import MeterEmulator
+from sml_samples import load_captures
+
+
+def rss_kb(pid):
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(commands, settle):
+    processes = [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for command in commands]
+    try:
+        time.sleep(settle)
+        if any(p.poll() is not None for p in processes):
+            return None
+        return sum(rss_kb(p.pid) for p in processes)
+    finally:
+        for p in processes:
+            p.terminate()
+            p.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per meter, one process versus one per meter')
+    parser.add_argument('captures', nargs='*')
+    parser.add_argument('--meters', type=int, default=3)
+    parser.add_argument('--settle', type=float, default=10.0, help='seconds before measuring')
+    parser.add_argument('--mode', default='poll', help='ReadMode')
+    args = parser.parse_args()
+
+    daemon = start_private_bus()
+    try:
+        capture = load_captures(args.captures, count=100)
+        emulators = [MeterEmulator(capture) for i in range(args.meters)]
+        for emulator in emulators:
+            emulator.start()
+        ports = [emulator.port for emulator in emulators]
+
+        # a device instance per port, the same in both runs
+        directory = tempfile.mkdtemp(prefix='bench_memory_')
+        sections = {'Meter ' + os.path.basename(port): {'DeviceInstance': 40 + i} for i, port in enumerate(ports)}
+        driver = install_driver(directory, {'ReadMode': args.mode,
+                                            'StateFile': os.path.join(directory, 'state_{tty}.json')}, sections)
+
+        single = measure([[sys.executable, driver] + ports], args.settle)
+        separate = measure([[sys.executable, driver, port] for port in ports], args.settle)
+
+        print('%d meters, mode %s' % (args.meters, args.mode))
+        for name, total in (('one process', single), ('process per meter', separate)):
+            if total is None:
+                print('%-18s driver exited' % name)
+            else:
+                print('%-18s %8.1f MB total %8.1f MB/meter' % (name, total / 1024.0, total / 1024.0 / args.meters))
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compare publishing one meter reading path by path (one PropertiesChanged per
+# path) with publishing it through a ServiceContext (one ItemsChanged per reading).
+# Reports D-Bus messages per reading, as seen by a subscriber on a second
+# connection, and the time spent in the publishing code.
+#
+# usage: python3 benchmarks/bench_publish.py [readings]
+
+import sys
+import time
+
+from dbus_session import start_private_bus, drain_mainloop
+
+PATHS = ['/Ac/Power', '/Ac/Current', '/Ac/Voltage', '/Ac/Energy/Forward', '/Ac/Energy/Reverse'] + \
+    ['/Ac/L%d/%s' % (l, n) for l in (1, 2, 3) for n in ('Voltage', 'Current', 'Power')] + ['/UpdateIndex']
+
+
+def _w(p, v): return (str(round(v, 1)) + ' W')
+
+
+def reading(i):
+    # every value changes, like with a busy meter
+    power = 1000.0 + i
+    values = {p: power / 3 for p in PATHS}
+    values['/Ac/Power'] = power
+    values['/UpdateIndex'] = i % 256
+    return values
+
+
+def publish_single(service, values):
+    for path, value in values.items():
+        service[path] = value
+
+
+def publish_batch(service, values):
+    with service as s:
+        for path, value in values.items():
+            s[path] = value
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    daemon = start_private_bus()
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+        DBusGMainLoop(set_as_default=True)
+        from vedbus import VeDbusService
+
+        service = VeDbusService('com.victronenergy.grid.bench_publish', bus=dbus.bus.BusConnection(
+            dbus.bus.BUS_SESSION))
+        for path in PATHS:
+            service.add_path(path, 0, gettextcallback=_w)
+
+        counts = {'PropertiesChanged': 0, 'ItemsChanged': 0}
+
+        def count(*args, **kwargs):
+            counts[kwargs['member']] += 1
+        listener = dbus.bus.BusConnection(dbus.bus.BUS_SESSION)
+        for signal in counts:
+            listener.add_signal_receiver(count, signal_name=signal, member_keyword='member',
+                                         dbus_interface='com.victronenergy.BusItem')
+
+        print('%-8s %10s %14s %14s' % ('mode', 'readings', 'msgs/reading', 'us/reading'))
+        offset = 0
+        for name, publish in (('single', publish_single), ('batch', publish_batch)):
+            drain_mainloop()
+            for signal in counts:
+                counts[signal] = 0
+            elapsed = 0.0
+            for i in range(readings):
+                values = reading(offset + i)
+                start = time.perf_counter()
+                publish(service, values)
+                elapsed += time.perf_counter() - start
+                drain_mainloop()
+            offset += readings
+            # give the bus a moment to deliver the last signals
+            end = time.time() + 0.5
+            while time.time() < end:
+                drain_mainloop()
+            messages = sum(counts.values())
+            print('%-8s %10d %14.2f %14.1f' % (name, readings, messages / readings, elapsed / readings * 1e6))
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Run the driver against the meter emulator on a private dbus-daemon and report
+# frames/s published, CPU time per frame and the latency from the last byte of a
+# frame to the D-Bus signal carrying its /Ac/Power.
+#
+# usage: python3 benchmarks/bench_service.py [--mode poll|watch|thread] [--decoder smllib|fast]
+#            [--baud 9600] [--period 1] [--duration 30] [capture.bin ...]
+#
+# Latency is measured against the most recently sent frame, so captures should
+# have a changing power value in every frame (the synthetic capture does).
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from dbus_session import start_private_bus, install_driver, process_cpu_time
+from sml_replay import MeterEmulator
+from sml_samples import load_captures
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the driver against a replayed meter')
+    parser.add_argument('captures', nargs='*')
+    parser.add_argument('--mode', default='poll', help='ReadMode')
+    parser.add_argument('--decoder', default='smllib', help='Decoder')
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--period', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to measure')
+    parser.add_argument('--warmup', type=float, default=8.0, help='seconds before measuring')
+    args = parser.parse_args()
+
+    daemon = start_private_bus()
+    service = None
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+        from gi.repository import GLib
+        DBusGMainLoop(set_as_default=True)
+        bus = dbus.SessionBus()
+
+        emulator = MeterEmulator(load_captures(args.captures, count=100), baud=args.baud, period=args.period)
+        emulator.start()
+
+        directory = tempfile.mkdtemp(prefix='bench_service_')
+        # a state file of its own, a run never warm starts from an earlier one
+        driver = install_driver(directory, {'ReadMode': args.mode, 'Decoder': args.decoder,
+                                            'StateFile': os.path.join(directory, 'state_{tty}.json')})
+        service = subprocess.Popen([sys.executable, driver, emulator.port],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        latencies = []
+        measuring = [False]
+
+        def power_changed(now):
+            if measuring[0] and emulator.sent:
+                latencies.append(now - emulator.sent[-1])
+
+        def items_changed(changes):
+            if '/Ac/Power' in changes:
+                power_changed(time.monotonic())
+
+        def properties_changed(changes, path=None):
+            if path == '/Ac/Power':
+                power_changed(time.monotonic())
+
+        bus.add_signal_receiver(items_changed, signal_name='ItemsChanged',
+                                dbus_interface='com.victronenergy.BusItem', path='/')
+        bus.add_signal_receiver(properties_changed, signal_name='PropertiesChanged',
+                                dbus_interface='com.victronenergy.BusItem', path_keyword='path')
+
+        mainloop = GLib.MainLoop()
+        state = {}
+
+        def start_measuring():
+            measuring[0] = True
+            state['cpu'] = process_cpu_time(service.pid)
+            state['start'] = time.monotonic()
+            GLib.timeout_add(int(args.duration * 1000), stop_measuring)
+            return False
+
+        def stop_measuring():
+            measuring[0] = False
+            state['cpu'] = process_cpu_time(service.pid) - state['cpu']
+            state['elapsed'] = time.monotonic() - state['start']
+            mainloop.quit()
+            return False
+
+        GLib.timeout_add(int(args.warmup * 1000), start_measuring)
+        mainloop.run()
+
+        if service.poll() is not None:
+            print('Driver exited with %d' % service.returncode)
+            return
+        if not latencies:
+            print('No /Ac/Power updates received')
+            return
+        frames = len(latencies)
+        print('mode %s, decoder %s, %d baud, period %.2fs' % (args.mode, args.decoder, args.baud, args.period))
+        print('frames/s          %8.2f' % (frames / state['elapsed']))
+        print('cpu ms/frame      %8.2f' % (state['cpu'] / frames * 1000))
+        print('latency ms p50    %8.1f' % (percentile(latencies, 0.5) * 1000))
+        print('latency ms p95    %8.1f' % (percentile(latencies, 0.95) * 1000))
+        print('latency ms max    %8.1f' % (max(latencies) * 1000))
+    finally:
+        if service is not None and service.poll() is None:
+            service.terminate()
+            service.wait()
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
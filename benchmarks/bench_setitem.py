@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Cost per path of VeDbusService.__setitem__ for every text policy: path by path
+# (value, text and one PropertiesChanged per path) and inside a ServiceContext (value
+# and text only, the ItemsChanged of the batch is timed separately). The readings
+# look like a meter's: power changes with every frame, voltages and energy counters
+# repeat their values most of the time.
+#
+# usage: python3 benchmarks/bench_setitem.py [readings]
+
+import sys
+import time
+
+from dbus_session import start_private_bus, drain_mainloop
+
+
+def _kwh(p, v): return (str(round(v, 2)) + ' KWh')
+def _a(p, v): return (str(round(v, 1)) + ' A')
+def _w(p, v): return (str(round(v, 1)) + ' W')
+def _v(p, v): return (str(round(v, 1)) + ' V')
+
+
+PATHS = {'/Ac/Power': _w, '/Ac/Current': _a, '/Ac/Voltage': _v,
+         '/Ac/Energy/Forward': _kwh, '/Ac/Energy/Reverse': _kwh}
+for _l in (1, 2, 3):
+    PATHS.update({'/Ac/L%d/Voltage' % _l: _v, '/Ac/L%d/Current' % _l: _a, '/Ac/L%d/Power' % _l: _w})
+
+
+def reading(i):
+    power = 1000.0 + (i * 7) % 500
+    voltage = 230.0 + i % 3
+    values = {'/Ac/Power': power, '/Ac/Current': power / voltage, '/Ac/Voltage': voltage,
+              '/Ac/Energy/Forward': 12345.6 + i // 100 * 0.01, '/Ac/Energy/Reverse': 0.0}
+    for l in (1, 2, 3):
+        values.update({'/Ac/L%d/Voltage' % l: voltage, '/Ac/L%d/Current' % l: power / 3 / voltage,
+                       '/Ac/L%d/Power' % l: power / 3})
+    return values
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    daemon = start_private_bus()
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+        DBusGMainLoop(set_as_default=True)
+        from vedbus import VeDbusService, TEXT_EAGER, TEXT_CACHED, TEXT_LAZY
+
+        print('%-8s %16s %16s %16s' % ('policy', 'single us/path', 'batch us/path', 'flush us/batch'))
+        for policy in (TEXT_EAGER, TEXT_CACHED, TEXT_LAZY):
+            service = VeDbusService('com.victronenergy.grid.bench_setitem_' + policy, textpolicy=policy,
+                                    bus=dbus.bus.BusConnection(dbus.bus.BUS_SESSION))
+            for path, text in PATHS.items():
+                service.add_path(path, 0, gettextcallback=text)
+
+            single = 0.0
+            batch = 0.0
+            flush = 0.0
+            sets = 0
+            for i in range(readings):
+                values = reading(2 * i)
+                start = time.perf_counter()
+                for path, value in values.items():
+                    service[path] = value
+                single += time.perf_counter() - start
+
+                values = reading(2 * i + 1)
+                context = service.__enter__()
+                start = time.perf_counter()
+                for path, value in values.items():
+                    context[path] = value
+                batch += time.perf_counter() - start
+                start = time.perf_counter()
+                service.__exit__(None, None, None)
+                flush += time.perf_counter() - start
+                sets += len(values)
+                drain_mainloop()
+            print('%-8s %16.1f %16.1f %16.1f' % (policy, single / sets * 1e6, batch / sets * 1e6, flush / readings * 1e6))
+            service.__del__()
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
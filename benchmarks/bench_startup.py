@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Startup time of the driver against the meter emulator: from process start to the
+# service name on D-Bus and to the first published /Ac/Power. Cold starts run
+# without a state file, warm starts with the one the previous run left behind.
+#
+# usage: python3 benchmarks/bench_startup.py [--runs 5] [--mode poll|watch|thread] [capture.bin ...]
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from dbus_session import start_private_bus, install_driver
+from sml_replay import MeterEmulator
+from sml_samples import load_captures
+
+SERVICE = 'com.victronenergy.grid.sml_40'
+
+
+def run_once(bus, driver, port, timeout=30):
+    from gi.repository import GLib
+
+    mainloop = GLib.MainLoop()
+    times = {}
+    start = time.monotonic()
+
+    def name_owner_changed(name, old, new):
+        if name == SERVICE and new and 'registered' not in times:
+            times['registered'] = time.monotonic() - start
+
+    def power(changes):
+        value = changes.get('Value')
+        if value is not None and not (hasattr(value, 'signature') and len(value) == 0) and 'power' not in times:
+            times['power'] = time.monotonic() - start
+            mainloop.quit()
+
+    def items_changed(changes):
+        if '/Ac/Power' in changes:
+            power(changes['/Ac/Power'])
+
+    def properties_changed(changes, path=None):
+        if path == '/Ac/Power':
+            power(changes)
+
+    matches = [
+        bus.add_signal_receiver(name_owner_changed, signal_name='NameOwnerChanged'),
+        bus.add_signal_receiver(items_changed, signal_name='ItemsChanged',
+                                dbus_interface='com.victronenergy.BusItem', path='/'),
+        bus.add_signal_receiver(properties_changed, signal_name='PropertiesChanged',
+                                dbus_interface='com.victronenergy.BusItem', path_keyword='path'),
+    ]
+    service = subprocess.Popen([sys.executable, driver, port], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    GLib.timeout_add(timeout * 1000, mainloop.quit)
+    mainloop.run()
+    service.terminate()
+    service.wait()
+    for match in matches:
+        match.remove()
+    return times.get('registered'), times.get('power')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure driver startup time')
+    parser.add_argument('captures', nargs='*')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--mode', default='poll', help='ReadMode')
+    args = parser.parse_args()
+
+    daemon = start_private_bus()
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+        DBusGMainLoop(set_as_default=True)
+        bus = dbus.SessionBus()
+
+        emulator = MeterEmulator(load_captures(args.captures, count=100))
+        emulator.start()
+
+        directory = tempfile.mkdtemp(prefix='bench_startup_')
+        statefile = os.path.join(directory, 'state_{tty}.json')
+        driver = install_driver(directory, {'ReadMode': args.mode, 'StateFile': statefile})
+
+        print('%-6s %14s %14s' % ('start', 'registered s', '/Ac/Power s'))
+        for kind in ('cold', 'warm'):
+            for i in range(args.runs):
+                if kind == 'cold':
+                    for filename in os.listdir(directory):
+                        if filename.startswith('state_'):
+                            os.unlink(os.path.join(directory, filename))
+                registered, power = run_once(bus, driver, emulator.port)
+                print('%-6s %14s %14s' % (kind, '%.3f' % registered if registered else '-', '%.3f' % power if power else '-'))
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Subtree reads (GetValue/GetText on a node like /Ac or /Ac/L1, as dbus-spy and VRM
+# polling do) on a service with a few hundred paths, like a meter with many mapped
+# registers. Compares the sorted path index of VeDbusService with a scan of all
+# paths, which is what the tree exports did before, GetItems of the whole service
+# served from its snapshot, and taking the registers out again one by one and with
+# remove_paths.
+#
+# usage: python3 benchmarks/bench_tree.py [registers] [rounds]
+
+import sys
+import time
+
+from dbus_session import start_private_bus
+
+NODES = ['/Ac', '/Ac/L1', '/Ac/L2/Power', '/Registers', '/Registers/100', '/Mgmt']
+
+
+def _w(p, v): return (str(round(v, 1)) + ' W')
+
+
+def scan(service, path, get_text=False):
+    from ve_utils import wrap_dbus_value
+    px = path + '/'
+    r = {}
+    for p, item in service._dbusobjects.items():
+        if p.startswith(px):
+            r[p[len(px):]] = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
+    return r
+
+
+def add_registers(service, registers):
+    for r in range(registers):
+        service.add_path('/Registers/%d/Value' % r, float(r), gettextcallback=_w)
+
+
+def bench(name, func, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    registers = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    daemon = start_private_bus()
+    try:
+        import dbus
+        from dbus.mainloop.glib import DBusGMainLoop
+        DBusGMainLoop(set_as_default=True)
+        from vedbus import VeDbusService
+
+        service = VeDbusService('com.victronenergy.grid.bench_tree', bus=dbus.bus.BusConnection(dbus.bus.BUS_SESSION))
+        service.add_path('/Mgmt/ProcessName', 'bench_tree')
+        service.add_path('/Ac/Power', 1000.0, gettextcallback=_w)
+        for l in (1, 2, 3):
+            for n in ('Power', 'Voltage', 'Current'):
+                service.add_path('/Ac/L%d/%s' % (l, n), 1.0, gettextcallback=_w)
+                service.add_path('/Ac/L%d/%s/Max' % (l, n), 1.0, gettextcallback=_w)
+        add_registers(service, registers)
+        print('%d paths' % len(service._dbusobjects))
+
+        print('%-16s %6s %12s %12s %12s' % ('node', 'items', 'scan us', 'index us', 'text us'))
+        for path in NODES:
+            node = service._dbusnodes[path]
+            items = len(node.GetValue())
+            if scan(service, path) != dict(node.GetValue()):
+                print('%s: index and scan disagree' % path)
+            print('%-16s %6d %12.1f %12.1f %12.1f' % (
+                path, items,
+                bench('scan', lambda: scan(service, path), rounds),
+                bench('index', node.GetValue, rounds),
+                bench('text', node.GetText, rounds)))
+
+        # GetItems of the whole service: nothing changed since the last call, and one
+        # path changed, like between two meter readings and right after one
+        root = service._dbusnodes['/']
+        power = service._dbusobjects['/Ac/Power']
+        counter = [0]
+
+        def one_change():
+            counter[0] += 1
+            power._local_set_value(1000.0 + counter[0])
+            return root.GetItems()
+        print('GetItems unchanged   %8.1f us' % bench('unchanged', root.GetItems, rounds))
+        print('GetItems one change  %8.1f us' % bench('one change', one_change, rounds))
+
+        # a meter that drops its registers, each removal also cleans up the nodes
+        def one_by_one():
+            for r in range(registers):
+                del service['/Registers/%d/Value' % r]
+        print('remove one by one    %8.1f ms' % (bench('one by one', one_by_one, 1) / 1000))
+        add_registers(service, registers)
+        print('remove_paths         %8.1f ms' % (bench('subtree', lambda: service.remove_paths('/Registers'), 1) / 1000))
+    finally:
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Cost of wrapping the values of one meter reading for D-Bus: the generic
+# wrap_dbus_value (isinstance chain per value) versus the wrappers chosen once per
+# path from its valuetype. Doesn't need a bus, only dbus-python.
+#
+# usage: python3 benchmarks/bench_wrap.py [readings]
+
+import sys
+import time
+
+import dbus_session  # noqa: F401, puts the driver modules on the path
+
+from ve_utils import wrap_dbus_value, typed_dbus_wrapper
+
+PATHS = ['/Ac/Power', '/Ac/Current', '/Ac/Voltage', '/Ac/Energy/Forward', '/Ac/Energy/Reverse'] + \
+    ['/Ac/L%d/%s' % (l, n) for l in (1, 2, 3) for n in ('Voltage', 'Current', 'Power')]
+
+
+def reading(i):
+    power = 1000.0 + i
+    values = {p: power / 3 for p in PATHS}
+    values['/Ac/Power'] = power
+    return values
+
+
+def bench(name, wrappers, readings):
+    values = [reading(i) for i in range(readings)]
+    start = time.perf_counter()
+    for v in values:
+        for path, value in v.items():
+            wrappers[path](value)
+    elapsed = time.perf_counter() - start
+    print('%-10s %10.2f us/reading %8.3f us/value' % (
+        name, elapsed / readings * 1e6, elapsed / (readings * len(PATHS)) * 1e6))
+
+
+def main():
+    readings = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench('generic', {p: wrap_dbus_value for p in PATHS}, readings)
+    bench('typed', {p: typed_dbus_wrapper(float) for p in PATHS}, readings)
+
+
+if __name__ == "__main__":
+    main()
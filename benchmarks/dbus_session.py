@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Helpers for the benchmarks: a private dbus-daemon, so nothing on the system bus
+# is disturbed and no other service adds noise to the numbers.
+
+import os
+import subprocess
+import sys
+
+# the driver modules live one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+
+# Start a private session bus and point DBUS_SESSION_BUS_ADDRESS at it, so
+# VeDbusService and child processes connect to it. Returns the daemon process,
+# terminate it when done.
+def start_private_bus():
+    daemon = subprocess.Popen(['dbus-daemon', '--session', '--nofork', '--print-address'],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    address = daemon.stdout.readline().strip()
+    os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+    return daemon
+
+
+# Run the GLib mainloop until nothing is pending anymore
+def drain_mainloop(context=None):
+    from gi.repository import GLib
+    context = context or GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+# Copy the driver into a temporary directory with its config.ini settings
+# overridden, so a benchmark can run it in any mode without touching the checkout.
+# Returns the path of the driver script.
+def install_driver(directory, settings=None, sections=None):
+    import configparser
+    import glob
+    import shutil
+
+    source = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    for filename in glob.glob(os.path.join(source, '*.py')):
+        shutil.copy(filename, directory)
+
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(os.path.join(source, 'config.ini'))
+    for key, value in (settings or {}).items():
+        config['DEFAULT'][key] = str(value)
+    for section, values in (sections or {}).items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config[section][key] = str(value)
+    with open(os.path.join(directory, 'config.ini'), 'w') as f:
+        config.write(f)
+    return os.path.join(directory, 'dbus-gridmeter_sml.py')
+
+
+# CPU seconds (user + system) used by a process so far
+def process_cpu_time(pid):
+    with open('/proc/%d/stat' % pid) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
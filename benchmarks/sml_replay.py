@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Meter emulator: replays recorded SML captures (raw .bin dumps of the serial port)
+# through a pseudo terminal, paced like a real meter on an IR head: bytes at the
+# chosen baud rate, one frame every period seconds. Point the driver at the printed
+# port, or use MeterEmulator from a benchmark.
+#
+# usage: python3 benchmarks/sml_replay.py [--baud 9600] [--period 1] [--link /tmp/ttySML] [capture.bin ...]
+
+import argparse
+import os
+import threading
+import time
+import tty
+
+from sml_samples import load_captures
+
+START = b'\x1b\x1b\x1b\x1b\x01\x01\x01\x01'
+
+
+# Split a capture at the frame start sequences. Whatever is between two frames (noise,
+# broken frames) stays attached to the frame before it, so it is replayed as well.
+def split_frames(data):
+    starts = []
+    pos = data.find(START)
+    while pos != -1:
+        starts.append(pos)
+        pos = data.find(START, pos + len(START))
+    if not starts:
+        return [data]
+    starts[0] = 0
+    return [data[a:b] for a, b in zip(starts, starts[1:] + [len(data)])]
+
+
+class MeterEmulator(threading.Thread):
+    # chunk: bytes written at once, a USB IR head delivers small chunks as well
+    def __init__(self, capture, baud=9600, period=1.0, chunk=16, count=None, link=None):
+        threading.Thread.__init__(self, name='meter-emulator')
+        self.daemon = True
+        self.frames = split_frames(capture)
+        self.byte_time = 10.0 / baud  # 8N1: start bit, 8 data bits, stop bit
+        self.period = period
+        self.chunk = chunk
+        self.count = count
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        if link:
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(self.port, link)
+            self.port = link
+
+        self._quit = threading.Event()
+        # time.monotonic() of the last byte of every frame sent
+        self.sent = []
+
+    def run(self):
+        index = 0
+        while not self._quit.is_set() and (self.count is None or index < self.count):
+            frame = self.frames[index % len(self.frames)]
+            start = time.monotonic()
+            for pos in range(0, len(frame), self.chunk):
+                # a chunk is complete after its transmission time
+                wait = start + (pos + self.chunk) * self.byte_time - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                os.write(self._master, frame[pos:pos + self.chunk])
+            self.sent.append(time.monotonic())
+            index += 1
+            wait = start + self.period - time.monotonic()
+            if wait > 0:
+                self._quit.wait(wait)
+
+    def stop(self):
+        self._quit.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay SML captures through a pseudo terminal')
+    parser.add_argument('captures', nargs='*', help='raw serial dumps, a synthetic capture is used without')
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--period', type=float, default=1.0, help='seconds between frame starts')
+    parser.add_argument('--link', help='create a symlink to the pty under this name')
+    args = parser.parse_args()
+
+    emulator = MeterEmulator(load_captures(args.captures), baud=args.baud, period=args.period, link=args.link)
+    print('Replaying %d frames on %s' % (len(emulator.frames), emulator.port))
+    emulator.start()
+    try:
+        while emulator.is_alive():
+            emulator.join(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
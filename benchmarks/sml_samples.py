@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Sample data for the benchmarks: recorded captures from disk, or a synthetic
+# frame that looks like what a common eHZ meter sends (open response, get list
+# response with identity, energy and power registers, close response).
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+
+def _tl(t, n):
+    assert n + 1 < 16
+    return bytes([t | (n + 1)])
+
+def _octet(b): return _tl(0x00, len(b)) + b
+def _unsigned(v, n): return _tl(0x60, n) + v.to_bytes(n, 'big')
+def _signed(v, n): return _tl(0x50, n) + v.to_bytes(n, 'big', signed=True)
+def _list(*items): return bytes([0x70 | len(items)]) + b''.join(items)
+_NONE = b'\x01'
+
+
+def _message(transaction, tag, body):
+    return _list(_octet(transaction.to_bytes(4, 'big')), _unsigned(0, 1), _unsigned(0, 1),
+                 _list(_unsigned(tag, 4), body), _unsigned(0, 2), b'\x00')
+
+
+def _entry(obis, value, scaler=None, unit=None, valtime=_NONE):
+    return _list(_octet(bytes.fromhex(obis)), _NONE, valtime, _unsigned(unit, 1) if unit else _NONE,
+                 _signed(scaler, 1) if scaler is not None else _NONE, value, _NONE)
+
+
+# Complete SML file (escape sequences, padding, CRC) as sent by the meter
+def sample_frame(power=1234, energy=56789012, seq=1):
+    from smllib.crc import x25
+    server = bytes.fromhex('0a01454d4800004a3c41')
+    body = _message(seq, 0x0101, _list(_NONE, _NONE, _octet(b'\x00\x01\x02\x03'), _octet(server), _NONE, _NONE))
+    values = _list(
+        _entry('8181c78203ff', _octet(b'EMH')),
+        _entry('0100000009ff', _octet(server)),
+        _entry('0100010800ff', _unsigned(energy, 8), scaler=-1, unit=30,
+               valtime=_list(_unsigned(1, 1), _unsigned(seq, 4))),
+        _entry('0100020800ff', _unsigned(0, 8), scaler=-1, unit=30),
+        _entry('0100100700ff', _signed(power, 4), scaler=0, unit=27),
+    )
+    body += _message(seq + 1, 0x0701, _list(_NONE, _octet(server), _NONE, _NONE, values, _NONE, _NONE))
+    body += _message(seq + 2, 0x0201, _list(_NONE))
+    data = b'\x1b\x1b\x1b\x1b\x01\x01\x01\x01' + body
+    pad = (-len(data)) % 4
+    data += b'\x00' * pad + b'\x1b\x1b\x1b\x1b\x1a' + bytes([pad])
+    return data + x25.get_crc(data).to_bytes(2, 'big')
+
+
+# A capture with count frames and changing power values
+def sample_capture(count=10):
+    return b''.join(sample_frame(power=1000 + 37 * i, energy=56789012 + i, seq=3 * i) for i in range(count))
+
+
+# Read raw serial dumps, use the synthetic capture if none are given
+def load_captures(filenames, count=10):
+    if not filenames:
+        return sample_capture(count)
+    data = b''
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            data += f.read()
+    return data
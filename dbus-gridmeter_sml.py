@@ -1,51 +1,190 @@
 #!/usr/bin/python
-from smllib import SmlStreamReader
-from smllib import errors as smlerr
-import serial
-from serial import SerialException
-
 # import normal packages
-import platform
 import logging
 import os
 import sys
-if sys.version_info.major == 2:
-    import gobject
-else:
-    from gi.repository import GLib as gobject
-import sys
 import time
 import configparser  # for config/ini file
 import traceback
 
-# our own packages from victron
-sys.path.insert(1, os.path.join(os.path.dirname(__file__),'/opt/victronenergy/dbus-systemcalc-py/ext/velib_python'))
-from vedbus import VeDbusService
+from startup_profile import profile
+
+with profile.phase('import serial'):
+    from serial import SerialException
+    from sml_serial import open_port, detect_line, Backoff
+    from sml_reader import LatestValue, SmlReaderThread, newest_reading
+with profile.phase('import driver modules'):
+    from sml_pipeline import SmlFramePipeline
+    from obis_mapping import ObisMapping, obis_to_bytes
+    from sml_decoder import SmlFastDecoder, SmlDecodeError, value_fingerprint
+    from sml_stats import FrameStatistics
+    from sml_cadence import CadenceScheduler
+    from publish_filter import DeadbandFilter, PublishTiers
+    from sml_state import load_state, save_state, remove_state
+
+# GLib, D-Bus and vedbus are imported by _importMainloop() once a meter answered, a
+# probe of a port without a meter never pays for them
+gobject = None
+VeDbusService = None
+
+
+def _importMainloop():
+    global gobject, VeDbusService
+    if VeDbusService is not None:
+        return
+    with profile.phase('import GLib'):
+        if sys.version_info.major == 2:
+            import gobject as glib
+        else:
+            from gi.repository import GLib as glib
+        gobject = glib
+    with profile.phase('import dbus'):
+        from dbus.mainloop.glib import DBusGMainLoop
+        # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
+        DBusGMainLoop(set_as_default=True)
+    with profile.phase('import vedbus'):
+        # our own packages from victron
+        sys.path.insert(1, os.path.join(os.path.dirname(__file__),'/opt/victronenergy/dbus-systemcalc-py/ext/velib_python'))
+        from vedbus import VeDbusService as service
+        VeDbusService = service
+
+
+# Own connection for a service sharing the process with others: every service exports
+# its objects from the root path, which a connection only has once
+def _privateBus():
+    import dbus
+    if 'DBUS_SESSION_BUS_ADDRESS' in os.environ:
+        return dbus.SessionBus(private=True)
+    return dbus.SystemBus(private=True)
+
+
+def _readConfig():
+    config = configparser.ConfigParser()
+    # keep the case of D-Bus paths used as keys
+    config.optionxform = str
+    config.read("%s/config.ini" %
+                (os.path.dirname(os.path.realpath(__file__))))
+    return config
+
+
+# No meter could be set up on a port
+class SmlMeterError(Exception):
+    pass
+
 
 class DbusSmlSmartmeterService:
-    def __init__(self, port, servicename, deviceinstance, paths, productname='Smartmeter SML Reader', connection='SML service'):
-        self._dbusservice = VeDbusService(f"{servicename}.sml_{deviceinstance:02d}", register=False)
-        self._paths = paths
+    # servicename and deviceinstance are the defaults for a port without a [Meter <tty>]
+    # section setting Role and DeviceInstance. With private_bus the service gets its own
+    # D-Bus connection, for several meters in one process. on_close is called when the
+    # service gives up on its port. discovered is the sml_discovery result for the port,
+    # its port is already open and its first frame in.
+    def __init__(self, port, servicename, deviceinstance, paths, productname='Smartmeter SML Reader', connection='SML service',
+                 private_bus=False, on_close=None, discovered=None):
+        self._paths = dict(paths)
         self.error_counter = 0
+        self._privateBus = private_bus
+        self._onClose = on_close
+        self._closed = False
 
-        self._config = self._getConfig()
-        self.serial_port = serial.Serial(port, 9600, timeout=1)
-        if not self.serial_port.is_open:
-            logging.error(f"{servicename} /DeviceInstance = {deviceinstance} Can't open serial port {port}")
-            sys.exit(1)
+        with profile.phase('read config'):
+            self._config = self._getConfig()
+        self._settings = self._getMeterSettings(port)
+        self.allowed_roles = ['grid', 'pvinverter', 'genset']
+        self.default_role = servicename.rsplit('.', 1)[-1]
+        self.role = self._getRole()
+        servicename = 'com.victronenergy.' + self.role
+        self._deviceinstance = deviceinstance = int(self._settings.get('DeviceInstance', deviceinstance))
+        self._obisMapping = ObisMapping.from_config(self._config, self._settings.name,
+                                                    self._getPortSection(port, 'ObisMapping'))
+        # registers mapped in config.ini that the driver doesn't know get published as they
+        # are, always as numbers
+        for path in self._obisMapping.paths:
+            self._paths.setdefault(path, {'initial': None, 'textformat': None, 'valuetype': float})
+        self._deadband = DeadbandFilter.from_config(self._config, self._getPortSection(port, 'Deadband'))
+        self._tiers = PublishTiers.from_config(self._config, self._getPortSection(port, 'PublishTiers'))
+        # the values faked from the total power are only needed with every frame if
+        # one of them is tier 0
+        self._tier0Derived = any(self._tiers.tier(path) == 0 for path in self._paths if path != '/Ac/Power')
+        # raw values of the last frame and the tiers that haven't published them yet
+        self._latest = None
+        self._dirty = set()
+        self._idleFlush = None
+        self._fastDecoder = None
+        if self._getDecoder() == 'fast':
+            self._fastDecoder = SmlFastDecoder(self._obisMapping.byte_index, {
+                obis_to_bytes(self._getSmartMeterManufacturerId()): 'mfg',
+                obis_to_bytes(self._getSmartMeterDeviceId()): 'serial'})
+        # frames measuring the same as the last decoded one are neither decoded nor
+        # published, for at most this many seconds
+        self._unchangedMaxAge = self._getUnchangedMaxAge()
+        self._fingerprint = None
+        self._fingerprintTime = 0
+        self._port = port
+        # what we know about the meter on this port from the last run
+        self._stateFile = self._getStateFile(port)
+        self._state = load_state(self._stateFile)
+
+        # (baudrate, framing), None if it has to be detected
+        self._line = self._getLine()
+        if discovered is not None:
+            self._pipeline = discovered.pipeline
+            self.serial_port = discovered.serial_port
+            # the discovery got a valid frame at the setting the port is at
+            self._line = (self.serial_port.baudrate, '%d%s%g' % (
+                self.serial_port.bytesize, self.serial_port.parity, self.serial_port.stopbits))
+        else:
+            # lives as long as the service, partial frames are kept between reads
+            self._pipeline = SmlFramePipeline()
+            with profile.phase('open serial port'):
+                self.serial_port = self._openPort()
+        if self.serial_port is None:
+            raise SmlMeterError(f"{servicename} /DeviceInstance = {deviceinstance} Can't open serial port {port}")
+        if self._line is None:
+            with profile.phase('detect baud rate'):
+                self._line = detect_line(self.serial_port)
+            if self._line is None:
+                self.serial_port.close()
+                raise SmlMeterError(f"{servicename} /DeviceInstance = {deviceinstance} No SML data on {port} at any baud rate")
+            logging.info(f"Using {self._line[0]} {self._line[1]} on {port}")
 
         logging.debug("%s /DeviceInstance = %d" %
                       (servicename, deviceinstance))
 
-        sm_serial = self._getSmartMeterSerial()
-        if sm_serial is None:
-            logging.error(f"{servicename} /DeviceInstance = {deviceinstance} Couldn't read device ID, is a SML device attached?")
-            sys.exit(1)
+        # frame latencies and counters
+        self._stats = FrameStatistics()
+        # when the meter sends, the period is remembered between runs
+        self._cadence = CadenceScheduler(self._state.get('period'))
+
+        first_data = None
+        if self._state.get('serial'):
+            # warm start: register right away with the cached identity, the first live
+            # frame confirms it in the background
+            sm_serial = self._state['serial']
+            self._identityConfirmed = False
+            logging.info(f"Using cached smartmeter {sm_serial} on {port}")
+        else:
+            with profile.phase('wait for identification frame'):
+                if discovered is not None:
+                    first_data = self._decodeSmlFrame(discovered.frame, True)
+                if not first_data:
+                    first_data = self._getSmlSmartmeterData(True)
+            if first_data is None or not first_data:
+                self.serial_port.close()
+                raise SmlMeterError(f"{servicename} /DeviceInstance = {deviceinstance} Couldn't read device ID, is a SML device attached?")
+            sm_serial = self._formatSerial(first_data)
+            self._identityConfirmed = True
+
+        # from here on we have a meter, or had one on this port before
+        _importMainloop()
+        with profile.phase('connect to D-Bus'):
+            bus = _privateBus() if private_bus else None
+            self._dbusservice = VeDbusService(f"{servicename}.sml_{deviceinstance:02d}", bus=bus, register=False,
+                                              textpolicy=self._getTextPolicy())
 
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
         self._dbusservice.add_path(
-            '/Mgmt/ProcessVersion', 'Unknown version, and running on Python ' + platform.python_version())
+            '/Mgmt/ProcessVersion', 'Unknown version, and running on Python ' + sys.version.split()[0])
         self._dbusservice.add_path('/Mgmt/Connection', '%s on %s' % (connection, port))
 
         # Create the mandatory objects
@@ -61,10 +200,7 @@ class DbusSmlSmartmeterService:
         self._dbusservice.add_path('/FirmwareVersion', 0.3)
         self._dbusservice.add_path('/HardwareVersion', 0)
         self._dbusservice.add_path('/Connected', 1)
-        self._dbusservice.add_path('/Role', 'grid')
-        self.allowed_roles = ['grid', 'pvinverter', 'genset']
-        self.default_role = 'grid'
-        self.role = self.default_role
+        self._dbusservice.add_path('/Role', self.role)
         self._dbusservice.add_path('/AllowedRoles', self.allowed_roles)
 
         # normaly only needed for pvinverter
@@ -72,65 +208,293 @@ class DbusSmlSmartmeterService:
         self._dbusservice.add_path('/Serial', sm_serial)
         self._dbusservice.add_path('/UpdateIndex', 0)
 
-        # add path values to dbus
+        for path in FrameStatistics.paths():
+            self._dbusservice.add_path(path, None)
+
+        # add path values to dbus, energy counters start from their cached values. With
+        # a cached identity nothing was read yet, the live values stay invalid until the
+        # first frame instead of showing 0 W
+        cached = self._state.get('values', {})
         for path, settings in self._paths.items():
+            initial = settings['initial'] if self._identityConfirmed else None
             self._dbusservice.add_path(
-                path, settings['initial'], gettextcallback=settings['textformat'], writeable=True, onchangecallback=self._handlechangedvalue)
+                path, cached.get(path, initial), gettextcallback=settings['textformat'], writeable=True, onchangecallback=self._handlechangedvalue,
+                valuetype=settings.get('valuetype'))
 
-        self._dbusservice.register()
-        self._dbusservice["/Connected"] = 1
+        with profile.phase('register on D-Bus'):
+            self._dbusservice.register()
+        # with a cached identity we are connected once the first frame is in
+        self._connected = self._identityConfirmed
+        self._dbusservice["/Connected"] = 1 if self._connected else 0
 
         # last update
         self._lastUpdate = 0
 
-        # add _update function 'timer'
-        # pause 500ms before the next request
-        gobject.timeout_add(500, self._update)
+        gobject.timeout_add(self._getStatsInterval() * 1000, self._publishStats)
+        for tier, interval in self._tiers.intervals.items():
+            if interval > 0:
+                gobject.timeout_add(int(interval * 1000), self._flushTier, tier)
+        gobject.timeout_add(self._getStateSaveInterval() * 1000, self._saveState)
+
+        # on a lost meter the port is reopened with growing delays, the service stays on D-Bus
+        self._backoff = Backoff()
+        self._readMode = self._getReadMode()
+        self._reader = None
+        self._source = None
+        self._reading = False
+        if self._readMode == 'thread':
+            # a background thread owns the port and decoding, the mainloop only publishes
+            # the newest reading it hands over
+            self._handoff = LatestValue(lambda: gobject.idle_add(self._onReading))
+        self._startReading()
+        if self._readMode != 'poll':
+            # a frame that is overdue counts as a failed read, same as in poll mode
+            gobject.timeout_add(int(self._cadence.until_overdue(time.monotonic()) * 1000) + 1, self._checkTimeout)
+
+        # the identification frame is a regular reading as well
+        if first_data:
+            self._publish(first_data)
+            self._saveState()
+
+
+    def _startReading(self):
+        self.error_counter = 0
+        self._cadence.restart(time.monotonic())
+        self._reading = True
+        if self._readMode == 'thread':
+            self.serial_port.timeout = 1
+            self._reader = SmlReaderThread(self.serial_port, self._pipeline, self._decodeLiveFrame, self._handoff,
+                                           lambda: gobject.idle_add(self._onReaderError))
+            self._reader.start()
+        elif self._readMode == 'watch':
+            # let the mainloop wake us up whenever the IR head delivers bytes, so the
+            # frame is decoded and published as soon as its last byte arrived
+            self.serial_port.timeout = 0
+            self._source = gobject.io_add_watch(self.serial_port.fileno(), gobject.PRIORITY_DEFAULT,
+                                                gobject.IO_IN | gobject.IO_ERR | gobject.IO_HUP, self._onSerialData)
+        else:
+            # _update reschedules itself for just before the next expected frame
+            self._scheduleUpdate()
+
+
+    def _scheduleUpdate(self):
+        delay = self._cadence.next_read(time.monotonic())
+        self._source = gobject.timeout_add(int(delay * 1000), self._update)
+
+
+    def _stopReading(self):
+        self._reading = False
+        if self._reader is not None:
+            self._reader.stop()
+            # the thread notices within the port timeout
+            self._reader.join(2)
+            self._stats.stale += self._reader.stale
+            self._reader = None
+        if self._source is not None:
+            gobject.source_remove(self._source)
+            self._source = None
+
+
+    def _disconnect(self):
+        logging.warning(f"Lost smartmeter on {self._port}, reconnecting")
+        self._stopReading()
+        try:
+            self.serial_port.close()
+        except SerialException:
+            pass
+        self._pipeline.clear()
+        self._invalidate()
+        self._scheduleReconnect()
+
 
+    def _scheduleReconnect(self):
+        delay = self._backoff.next()
+        logging.info(f"Reopening {self._port} in {delay}s")
+        gobject.timeout_add(int(delay * 1000), self._reconnect)
 
-    def _getSmartMeterSerial(self):
-        meter_data = self._getSmlSmartmeterData(True)
-        if meter_data is None or not meter_data:
-            return None
+
+    def _openPort(self):
+        if self._line is None:
+            # detect_line tries all settings on the open port
+            return open_port(self._port)
+        return open_port(self._port, self._line[0], framing=self._line[1])
+
+
+    def _reconnect(self):
+        serial_port = self._openPort()
+        if serial_port is None:
+            self._scheduleReconnect()
+        else:
+            # /Connected goes back to 1 with the first frame
+            self.serial_port = serial_port
+            self._startReading()
+        return False
+
+
+    def _formatSerial(self, meter_data):
         return "%s %s" % (meter_data['mfg'],meter_data['serial'])
 
 
+    def _confirmIdentity(self, meter_data):
+        sm_serial = self._formatSerial(meter_data)
+        if sm_serial != self._dbusservice['/Serial']:
+            logging.warning(f"Smartmeter on {self._port} is {sm_serial}, not {self._dbusservice['/Serial']} as cached")
+            self._dbusservice['/Serial'] = sm_serial
+        else:
+            logging.info(f"Smartmeter {sm_serial} confirmed")
+        self._identityConfirmed = True
+        self._saveState()
+
+
+    def _saveState(self):
+        if self._closed:
+            return False
+        # only what a warm start needs, energy counters are the last published ones
+        state = {'serial': self._dbusservice['/Serial'], 'period': self._cadence.period,
+                 'line': list(self._line), 'values': {}}
+        for path in ('/Ac/Energy/Forward', '/Ac/Energy/Reverse'):
+            if path in self._dbusservice and self._dbusservice[path] is not None:
+                state['values'][path] = self._dbusservice[path]
+        if self._identityConfirmed and state != self._state:
+            save_state(self._stateFile, state)
+            self._state = state
+        return True
+
+
     def _get_role_instance(self):
-        print("GetRoleInstance called")
-        return 'grid', 40
+        return self.role, self._deviceinstance
+
+
+    # [<name> <tty>] for the meter on a port if there is one, the shared [<name>]
+    # otherwise. Per port sections replace the shared one, they aren't merged
+    def _getPortSection(self, port, name):
+        section = '%s %s' % (name, os.path.basename(port))
+        return section if self._config.has_section(section) else name
+
+
+    # Settings of the meter on a port: the [Meter <tty>] section if there is one, every
+    # setting missing there comes from [DEFAULT]
+    def _getMeterSettings(self, port):
+        section = 'Meter ' + os.path.basename(port)
+        if self._config.has_section(section):
+            return self._config[section]
+        return self._config['DEFAULT']
+
+
+    def _getRole(self):
+        value = self._settings.get('Role', self.default_role).strip().lower()
+        if value not in self.allowed_roles:
+            logging.warning(f"Unknown Role {value}, using {self.default_role}")
+            value = self.default_role
+        return value
 
 
     def _getConfig(self):
-        config = configparser.ConfigParser()
-        config.read("%s/config.ini" %
-                    (os.path.dirname(os.path.realpath(__file__))))
-        return config
+        return _readConfig()
 
 
     def _getSmartMeterDeviceId(self):
-        value = self._config['DEFAULT']['SmlPathSmartMeterId']
+        value = self._settings['SmlPathSmartMeterId']
+        return value
+
+
+    def _getSmartMeterManufacturerId(self):
+        value = self._settings.get('SmlPathManufacturer', '129-129:199.130.3*255')
         return value
 
 
     def _getSmartMeterOverallConsumption(self):
-        value = self._config['DEFAULT']['SmlPathOverallConsumption']
+        value = self._settings['SmlPathOverallConsumption']
         return value
 
 
+    def _getStateFile(self, port):
+        # {tty} is replaced by the name of the port, e.g. ttyUSB0
+        value = self._settings.get('StateFile', '%s/state_{tty}.json' % (os.path.dirname(os.path.realpath(__file__))))
+        return value.replace('{tty}', os.path.basename(port))
+
+
+    def _getLine(self):
+        # Baudrate = auto: detected on the first start, later taken from the state file
+        baudrate = self._settings.get('Baudrate', '9600').strip().lower()
+        framing = self._settings.get('Framing', '8N1').strip().upper()
+        if baudrate != 'auto':
+            return int(baudrate), framing
+        line = self._state.get('line')
+        if isinstance(line, list) and len(line) == 2:
+            return int(line[0]), str(line[1])
+        return None
+
+
+    def _getStateSaveInterval(self):
+        # seconds between saves of the energy counters, the flash shouldn't see more
+        return max(10, int(self._settings.get('StateSaveInterval', '300')))
+
+
+    def _getReadMode(self):
+        # poll: timer reading the port just before the next frame, as the cadence scheduler
+        # expects it, watch: mainloop io watch on the serial fd,
+        # thread: background reader thread handing over the newest reading
+        value = self._settings.get('ReadMode', 'poll').strip().lower()
+        if value not in ('poll', 'watch', 'thread'):
+            logging.warning(f"Unknown ReadMode {value}, using poll")
+            value = 'poll'
+        return value
+
+
+    def _getUnchangedMaxAge(self):
+        # 0 decodes and publishes every frame
+        return max(0, int(self._settings.get('UnchangedMaxAge', '60')))
+
+
+    def _getTextPolicy(self):
+        # eager: format Text with every change, cached: once per distinct value,
+        # lazy: only when asked for, signals carry the value only
+        value = self._settings.get('TextPolicy', 'eager').strip().lower()
+        if value not in ('eager', 'cached', 'lazy'):
+            logging.warning(f"Unknown TextPolicy {value}, using eager")
+            value = 'eager'
+        return value
+
+
+    def _getStatsInterval(self):
+        # seconds between updates of the /Mgmt/Stats and /Mgmt/Latency paths
+        return max(1, int(self._settings.get('StatsInterval', '10')))
+
+
+    def _getDecoder(self):
+        # smllib: parse with smllib, fast: built-in decoder for the configured registers only
+        value = self._settings.get('Decoder', 'smllib').strip().lower()
+        if value not in ('smllib', 'fast'):
+            logging.warning(f"Unknown Decoder {value}, using smllib")
+            value = 'smllib'
+        return value
+
+
+    # Blocking read of the identification frame at startup
     def _getSmlSmartmeterData(self, parse = False):
         try:
             start = time.time()
-            sml_frame = None
-            stream = SmlStreamReader()
+            # a frame may already be complete from bytes of the last read
+            s = b''
+
+            while True:
+              # Add more bytes, once there are complete frames the pipeline returns them
+              frames = list(self._pipeline.feed(s))
+              if frames:
+                meter_data, stale = newest_reading(frames, lambda f: self._decodeSmlFrame(f, parse))
+                self._stats.stale += stale
+                return meter_data
 
-            while sml_frame is None:
               # we should get 1 msg per second, but sometimes it takes longer
-              if time.time()-start > 6:
+              if time.time()-start > CadenceScheduler.TIMEOUT:
                 logging.info("Smartmeter IR timeout")
+                self._stats.timeouts += 1
                 return None
               try:
                 toread = self.serial_port.inWaiting()
                 if toread < 1:
+                  s = b''
                   time.sleep(0.02)
                   continue
                 s = self.serial_port.read(toread)
@@ -138,122 +502,372 @@ class DbusSmlSmartmeterService:
                 logging.warning(traceback.format_exc())
                 return None
 
-              # Add more bytes, once it's a complete frame the SmlStreamReader will
-              # return the frame instead of None
-              stream.add(s)
+        except Exception as e:
+          logging.error(f"Exception in _getSmlSmartmeterData: {str(e)}")
+
+
+    def _decodeSmlFrame(self, sml_frame, parse = False):
+        try:
+            values = None
+            if self._fastDecoder is not None:
               try:
-                sml_frame = stream.get_frame()
-                if sml_frame is None:
-                   continue
+                values, identity = self._fastDecoder.decode(sml_frame.buffer, parse)
+              except SmlDecodeError as e:
+                # a structure we don't know, smllib will have a go at it
+                logging.debug(f"Fast decoder failed: {str(e)}")
 
-              except smlerr.CrcError as ce:
-                logging.info("CRC Error")
-                continue
+            if values is None:
+              # parse values
+              values = self._obisMapping.resolve(sml_frame.get_obis())
+              if parse:
+                identity = self._parseSmartMeterIdentity(sml_frame)
+
+            if '/Ac/Power' not in values:
+              logging.info("No power value in SML frame")
+              return None
 
-            # parse values
-            obis_values = sml_frame.get_obis()
             mfg = ''
             serialno = ''
             if parse:
-              for msg in sml_frame.parse_frame():
-                #logging.info(msg.format_msg())
-                for list_entry in getattr(msg.message_body, 'val_list', []):
-                  if '129-129:199.130.3' in list_entry.obis.obis_code:
-                    mfg = list_entry.value
-                  if '1-0:0.0.9' in list_entry.obis.obis_code:
-                    try:
-                      serialno = int(list_entry.value[-8:],16)
-                    except ValueError:
-                      serialno = list_entry.value
-
-            for list_entry in obis_values:
-              #logging.info('%s %s' % (list_entry.obis.obis_code, list_entry.value))
-              if '1-0:16.7.0' in list_entry.obis.obis_code:
-                power = float(list_entry.value)
-              if '1-0:1.8.0' in list_entry.obis.obis_code:
-                total = float(list_entry.value) * (10**list_entry.scaler)
-
-            return { 'power': power, 'total': total, 'mfg': mfg, 'serial': serialno }
+              mfg = identity.get('mfg', '')
+              serialno = identity.get('serial', '')
+              try:
+                serialno = int(serialno[-8:],16)
+              except (ValueError, TypeError):
+                pass
 
-        except Exception as e:
-          logging.error(f"Exception in _getSmlSmartmeterData: {str(e)}")
+            timing = (sml_frame.received, sml_frame.completed, sml_frame.checked, time.monotonic())
+            return { 'values': values, 'mfg': mfg, 'serial': serialno, 'timing': timing }
 
+        except Exception as e:
+          logging.error(f"Exception in _decodeSmlFrame: {str(e)}")
+
+
+    def _decodeLiveFrame(self, sml_frame):
+        # the identity is only parsed until a live frame confirmed it
+        if not self._identityConfirmed or not self._unchangedMaxAge:
+            return self._decodeSmlFrame(sml_frame, not self._identityConfirmed)
+
+        meter_data = None
+        if self._fastDecoder is not None:
+            # the fast decoder costs about as much as a fingerprint, a second walk over
+            # the frame would double the time for every changed one. Its values are
+            # compared instead
+            meter_data = self._decodeSmlFrame(sml_frame)
+            if not meter_data:
+                return meter_data
+            fingerprint = meter_data['values']
+        else:
+            try:
+                fingerprint = value_fingerprint(sml_frame.buffer)
+            except SmlDecodeError:
+                fingerprint = None
+        now = time.monotonic()
+        if fingerprint is not None and fingerprint == self._fingerprint and now - self._fingerprintTime < self._unchangedMaxAge:
+            # only counters and timestamps changed, the values on D-Bus are still right
+            return {'unchanged': True, 'timing': (sml_frame.received, sml_frame.completed, sml_frame.checked, now)}
+        if meter_data is None:
+            meter_data = self._decodeSmlFrame(sml_frame)
+        if meter_data:
+            self._fingerprint = fingerprint
+            self._fingerprintTime = now
+        return meter_data
+
+
+    def _parseSmartMeterIdentity(self, sml_frame):
+        identity = {}
+        mfg_id = self._getSmartMeterManufacturerId()
+        serial_id = self._getSmartMeterDeviceId()
+        for msg in sml_frame.parse_frame():
+          #logging.info(msg.format_msg())
+          for list_entry in getattr(msg.message_body, 'val_list', []):
+            if list_entry.obis.obis_code == mfg_id:
+              identity['mfg'] = list_entry.value
+            if list_entry.obis.obis_code == serial_id:
+              identity['serial'] = list_entry.value
+        return identity
 
 
     def _update(self):
         try:
-            # get data from smartmeter
-            meter_data = self._getSmlSmartmeterData()
-
-            if meter_data is None or not meter_data:
-              # exit on continuous failure - probably due to port probing
-              if self.error_counter > 4:
-                self._dbusservice['/Ac/Power'] = None
-                self._dbusservice['/Ac/L1/Voltage'] = None
-                self._dbusservice['/Ac/L2/Voltage'] = None
-                self._dbusservice['/Ac/L3/Voltage'] = None
-                self._dbusservice['/Ac/L1/Current'] = None
-                self._dbusservice['/Ac/L2/Current'] = None
-                self._dbusservice['/Ac/L3/Current'] = None
-                self._dbusservice['/Ac/L1/Power'] = None
-                self._dbusservice['/Ac/L2/Power'] = None
-                self._dbusservice['/Ac/L3/Power'] = None
-                self._dbusservice['/Ac/Current'] = None
-                self._dbusservice['/Ac/Voltage'] = None
-                self._dbusservice['/Ac/Energy/Forward'] = None
-                self._dbusservice['/Ac/Energy/Reverse'] = None
-                sys.exit(1)
-              self.error_counter += 1
-              return True
+            # one shot, rescheduled below
+            self._source = None
+            try:
+                toread = self.serial_port.inWaiting()
+                s = self.serial_port.read(toread) if toread > 0 else b''
+            except SerialException as e:
+                logging.warning(traceback.format_exc())
+                s = None
+                self._handleReadFailure()
+
+            if s is not None:
+                # everything that piled up is read at once, only the newest frame is
+                # published so the values don't trail behind after a stall
+                meter_data, stale = newest_reading(list(self._pipeline.feed(s)), self._decodeLiveFrame)
+                self._stats.stale += stale
+                if meter_data:
+                    self._publish(meter_data)
+
+            now = time.monotonic()
+            if self._reading and self._cadence.overdue(now):
+                self._onTimeout(now)
+            if self._reading:
+                self._scheduleUpdate()
+        except Exception as e:
+            logging.critical('Error at %s', '_update', exc_info=e)
+            sys.exit(1)
 
-            self.error_counter = 0
-            #logging.info('meter_data %s' % meter_data)
+        return False
 
-            # send data to DBus, fake all the values that we not have to make victron happy
-            total_value = meter_data['power']
-            phase_1 = total_value/3
-            phase_2 = total_value/3
-            phase_3 = total_value/3
-            grid_sold =  0
-            grid_bought = meter_data['total']/1000
-            voltage = 230
 
-            # positive: consumption, negative: feed into grid
-            self._dbusservice['/Ac/Power'] = total_value
-            self._dbusservice['/Ac/L1/Voltage'] = voltage
-            self._dbusservice['/Ac/L2/Voltage'] = voltage
-            self._dbusservice['/Ac/L3/Voltage'] = voltage
-            self._dbusservice['/Ac/L1/Current'] = phase_1 / voltage
-            self._dbusservice['/Ac/L2/Current'] = phase_2 / voltage
-            self._dbusservice['/Ac/L3/Current'] = phase_3 / voltage
-            self._dbusservice['/Ac/L1/Power'] = phase_1
-            self._dbusservice['/Ac/L2/Power'] = phase_2
-            self._dbusservice['/Ac/L3/Power'] = phase_3
-
-            self._dbusservice['/Ac/Current'] = total_value / voltage
-            self._dbusservice['/Ac/Voltage'] = voltage
-
-            self._dbusservice['/Ac/Energy/Forward'] = grid_bought
-            self._dbusservice['/Ac/Energy/Reverse'] = grid_sold
-
-            # increment UpdateIndex - to show that new data is available
-            index = self._dbusservice['/UpdateIndex'] + 1  # increment index
-            if index > 255:   # maximum value of the index
-                index = 0       # overflow from 255 to 0
-            self._dbusservice['/UpdateIndex'] = index
-            self._dbusservice['/DeviceInstance'] = 40  # muss irgendwie aktiv gesetzt werden damit es ankommt, sollte eigentlich nicht nötig sein
-
-
-            # update lastupdate vars
-            self._lastUpdate = time.time()
+    def _onSerialData(self, fd, condition):
+        try:
+            if not self._reading:
+                return False
+
+            if condition & (gobject.IO_ERR | gobject.IO_HUP):
+                logging.error("Serial port closed")
+                self._source = None
+                self._disconnect()
+                return False
+
+            try:
+                s = self.serial_port.read(max(1, self.serial_port.inWaiting()))
+            except SerialException as e:
+                logging.warning(traceback.format_exc())
+                self._handleReadFailure()
+                return True
+
+            # feed the bytes as they come, publish a frame the moment it is complete. If
+            # the mainloop was held up, only the newest of the frames waiting is published
+            meter_data, stale = newest_reading(list(self._pipeline.feed(s)), self._decodeLiveFrame)
+            self._stats.stale += stale
+            if meter_data:
+                self._publish(meter_data)
         except Exception as e:
-            logging.critical('Error at %s', '_update', exc_info=e)
+            logging.critical('Error at %s', '_onSerialData', exc_info=e)
+            sys.exit(1)
+
+        # keep the io watch installed
+        return True
+
+
+    def _onReading(self):
+        try:
+            meter_data = self._handoff.take()
+            # a reading may still arrive after the port was closed
+            if meter_data and self._reading:
+                self._publish(meter_data)
+        except Exception as e:
+            logging.critical('Error at %s', '_onReading', exc_info=e)
             sys.exit(1)
 
-        # return true, otherwise add_timeout will be removed from GObject - see docs http://library.isr.ist.utl.pt/docs/pygtk2reference/gobject-functions.html#function-gobject--timeout-add
+        # one shot, the handoff schedules us again for the next reading
+        return False
+
+
+    def _onReaderError(self):
+        if self._reading:
+            self._handleReadFailure()
+        return False
+
+
+    def _checkTimeout(self):
+        if self._closed:
+            return False
+        now = time.monotonic()
+        if self._reading and self._cadence.overdue(now):
+            self._onTimeout(now)
+        # wake up again when the next frame is due, the deadline moves with every frame
+        delay = self._cadence.until_overdue(now) if self._reading else 1.0
+        gobject.timeout_add(int(delay * 1000) + 1, self._checkTimeout)
+        return False
+
+
+    def _onTimeout(self, now):
+        # the meter sends at a steady pace, a frame that doesn't come is a failed read
+        logging.info("Smartmeter IR timeout")
+        self._stats.timeouts += 1
+        self._cadence.restart(now)
+        self._handleReadFailure()
+
+
+    def _handleReadFailure(self):
+        # reconnect on continuous failure, the service stays registered meanwhile
+        if self.error_counter > 4:
+            if not self._identityConfirmed:
+                # cached identity but no meter - probably due to port probing. Forget
+                # it, the next probe of this port waits for a frame before registering
+                logging.error(f"No smartmeter on {self._port}")
+                remove_state(self._stateFile)
+                self._state = {}
+                self._invalidate()
+                self.close()
+                return
+            self._disconnect()
+            return
+        self.error_counter += 1
+
+
+    def _invalidate(self):
+        self._deadband.reset()
+        self._fingerprint = None
+        self._latest = None
+        self._dirty.clear()
+        self._connected = False
+        with self._dbusservice as s:
+            s['/Connected'] = 0
+            for path in self._paths:
+                s[path] = None
+
+
+    # A frame with the values that are already on D-Bus: the meter is alive, only
+    # the freshness paths are updated
+    def _refresh(self, meter_data):
+        if not self._connected:
+            # the values were invalidated meanwhile, publish the next frame in full
+            self._fingerprint = None
+            return
+        self.error_counter = 0
+        self._stats.unchanged += 1
+        self._cadence.frame(meter_data['timing'][1])
+        with self._dbusservice as s:
+            self._markUpdated(s)
+
+
+    # increment UpdateIndex - to show that new data is available
+    def _markUpdated(self, s):
+        index = s['/UpdateIndex'] + 1  # increment index
+        if index > 255:   # maximum value of the index
+            index = 0       # overflow from 255 to 0
+        s['/UpdateIndex'] = index
+        s['/Connected'] = 1
+
+
+    def _publish(self, meter_data):
+        if meter_data.get('unchanged'):
+            self._refresh(meter_data)
+            return
+        self.error_counter = 0
+        if not self._identityConfirmed:
+            self._confirmIdentity(meter_data)
+        first = self._lastUpdate == 0
+        connecting = not self._connected
+        if connecting:
+            logging.info(f"Smartmeter on {self._port} is connected")
+            self._connected = True
+            self._backoff.reset()
+        #logging.info('meter_data %s' % meter_data)
+
+        # only tier 0 is published right away, the other tiers follow from the latest
+        # values when they are flushed
+        values = meter_data['values']
+        self._latest = values
+        self._dirty.update(self._tiers.intervals)
+        if self._tier0Derived:
+            values = self._deriveValues(values)
+        # slow paths only go out when they really changed
+        values = self._deadband.apply(self._tiers.select(values, (0,)), time.monotonic())
+
+        # the tier 0 values of one reading go out as a single ItemsChanged signal, the
+        # other tiers (per phase values, energy counters) follow in their own batches
+        with self._dbusservice as s:
+            # positive: consumption, negative: feed into grid
+            for path, value in values.items():
+                s[path] = value
+
+            self._markUpdated(s)
+            s['/DeviceInstance'] = self._deviceinstance  # muss irgendwie aktiv gesetzt werden damit es ankommt, sollte eigentlich nicht nötig sein
+
+        self._stats.frame_published(meter_data['timing'], time.monotonic())
+        self._cadence.frame(meter_data['timing'][1])
+
+        if connecting or first:
+            # no waiting for the slow tiers after the values were invalid or never set
+            self._flush(self._tiers.intervals)
+        elif self._idleFlush is None and any(not i for i in self._tiers.intervals.values()):
+            self._idleFlush = gobject.idle_add(self._flushIdle, priority=gobject.PRIORITY_LOW)
+
+        # update lastupdate vars
+        self._lastUpdate = time.time()
+        if first:
+            profile.mark('first /Ac/Power published')
+            profile.report()
+
+
+    # fake all the values that we not have to make victron happy
+    def _deriveValues(self, values):
+        values = dict(values)
+        total_value = values['/Ac/Power']
+        voltage = values.get('/Ac/Voltage', 230)
+        for phase in ('/Ac/L1', '/Ac/L2', '/Ac/L3'):
+            # without per phase registers, split the power evenly
+            phase_power = values.setdefault(phase + '/Power', total_value/3)
+            phase_voltage = values.setdefault(phase + '/Voltage', voltage)
+            values.setdefault(phase + '/Current', phase_power / phase_voltage)
+        values.setdefault('/Ac/Voltage', voltage)
+        values.setdefault('/Ac/Current', values['/Ac/L1/Current'] + values['/Ac/L2/Current'] + values['/Ac/L3/Current'])
+        values.setdefault('/Ac/Energy/Reverse', 0)
+        return values
+
+
+    # Publish the latest values of the given tiers, if a frame came in since their
+    # last flush
+    def _flush(self, tiers):
+        tiers = self._dirty.intersection(tiers)
+        if not tiers or not self._connected or self._latest is None:
+            return
+        self._dirty.difference_update(tiers)
+        values = self._tiers.select(self._deriveValues(self._latest), tiers)
+        values = self._deadband.apply(values, time.monotonic())
+        if values:
+            with self._dbusservice as s:
+                for path, value in values.items():
+                    s[path] = value
+
+
+    def _flushIdle(self):
+        self._idleFlush = None
+        self._flush([tier for tier, interval in self._tiers.intervals.items() if not interval])
+        return False
+
+
+    def _flushTier(self, tier):
+        if self._closed:
+            return False
+        self._flush((tier,))
         return True
 
 
+    def _publishStats(self):
+        if self._closed:
+            return False
+        with self._dbusservice as s:
+            values = self._stats.values(self._pipeline)
+            if self._reader is not None:
+                # counted by the reader thread until it stops
+                values['/Mgmt/Stats/StaleFrames'] += self._reader.stale
+            for path, value in values.items():
+                s[path] = value
+        return True
+
+
+    # Stop reading and take the service off D-Bus, the meter on the port is gone for good
+    def close(self):
+        self._stopReading()
+        try:
+            self.serial_port.close()
+        except SerialException:
+            pass
+        self._closed = True
+        bus = self._dbusservice.dbusconn
+        self._dbusservice.__del__()
+        if self._privateBus:
+            bus.close()
+        if self._onClose is not None:
+            self._onClose(self)
+
+
     def _handlechangedvalue(self, path, value):
         logging.debug("someone else updated %s to %s" % (path, value))
         return True  # accept the change
@@ -273,55 +887,95 @@ def main():
     try:
         logging.info("Start gridmeter_sml")
 
-        if len(sys.argv) > 1:
-            port = sys.argv[1]
-        else:
+        # options like --profile-startup are not ports. Every port given gets its own
+        # service, all of them run in this process
+        ports = [a for a in sys.argv[1:] if not a.startswith('--')]
+        discovered = [None] * len(ports)
+        if '--discover' in sys.argv:
+            # probe the given ports, or all USB serial ports, at once and take the ones
+            # a meter is sending on
+            from sml_discovery import candidate_ports, discover
+            settings = _readConfig()['DEFAULT']
+            baudrate = settings.get('Baudrate', '9600').strip().lower()
+            framing = settings.get('Framing', '8N1').strip().upper()
+            # Baudrate = auto can't be detected on all ports at once, they are probed
+            # at 9600 then
+            baudrate = 9600 if baudrate == 'auto' else int(baudrate)
+            with profile.phase('discover meters'):
+                discovered = discover(ports or candidate_ports(), timeout=CadenceScheduler.TIMEOUT,
+                                      baudrate=baudrate, framing=framing)
+            ports = [meter.port for meter in discovered]
+            if len(ports) == 0:
+                logging.error("No smartmeter found")
+                sys.exit(1)
+        if len(ports) == 0:
             logging.error("Error: no port given")
             sys.exit(-1)
 
-        from dbus.mainloop.glib import DBusGMainLoop
-        # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
-        DBusGMainLoop(set_as_default=True)
-
         # formatting
         def _kwh(p, v): return (str(round(v, 2)) + ' KWh')
         def _a(p, v): return (str(round(v, 1)) + ' A')
         def _w(p, v): return (str(round(v, 1)) + ' W')
         def _v(p, v): return (str(round(v, 1)) + ' V')
 
-        # start our main-service
-        pvac_output = DbusSmlSmartmeterService(
-            port,
-            servicename='com.victronenergy.grid',
-            deviceinstance=40,
-            paths={
-                # energy bought from the grid
-                '/Ac/Energy/Forward': {'initial': None, 'textformat': _kwh},
-                # energy sold to the grid
-                '/Ac/Energy/Reverse': {'initial': None, 'textformat': _kwh},
-                '/Ac/Power': {'initial': 0, 'textformat': _w},
-
-                '/Ac/Current': {'initial': 0, 'textformat': _a},
-                '/Ac/Voltage': {'initial': 230, 'textformat': _v},
-
-                '/Ac/L1/Voltage': {'initial': 230, 'textformat': _v},
-                '/Ac/L2/Voltage': {'initial': 230, 'textformat': _v},
-                '/Ac/L3/Voltage': {'initial': 230, 'textformat': _v},
-                '/Ac/L1/Current': {'initial': 0, 'textformat': _a},
-                '/Ac/L2/Current': {'initial': 0, 'textformat': _a},
-                '/Ac/L3/Current': {'initial': 0, 'textformat': _a},
-                '/Ac/L1/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/L2/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/L3/Power': {'initial': 0, 'textformat': _w},
-            })
+        paths = {
+            # energy bought from the grid
+            '/Ac/Energy/Forward': {'initial': None, 'textformat': _kwh, 'valuetype': float},
+            # energy sold to the grid
+            '/Ac/Energy/Reverse': {'initial': None, 'textformat': _kwh, 'valuetype': float},
+            '/Ac/Power': {'initial': 0, 'textformat': _w, 'valuetype': float},
+
+            '/Ac/Current': {'initial': 0, 'textformat': _a, 'valuetype': float},
+            '/Ac/Voltage': {'initial': 230, 'textformat': _v, 'valuetype': float},
+
+            '/Ac/L1/Voltage': {'initial': 230, 'textformat': _v, 'valuetype': float},
+            '/Ac/L2/Voltage': {'initial': 230, 'textformat': _v, 'valuetype': float},
+            '/Ac/L3/Voltage': {'initial': 230, 'textformat': _v, 'valuetype': float},
+            '/Ac/L1/Current': {'initial': 0, 'textformat': _a, 'valuetype': float},
+            '/Ac/L2/Current': {'initial': 0, 'textformat': _a, 'valuetype': float},
+            '/Ac/L3/Current': {'initial': 0, 'textformat': _a, 'valuetype': float},
+            '/Ac/L1/Power': {'initial': 0, 'textformat': _w, 'valuetype': float},
+            '/Ac/L2/Power': {'initial': 0, 'textformat': _w, 'valuetype': float},
+            '/Ac/L3/Power': {'initial': 0, 'textformat': _w, 'valuetype': float},
+        }
+
+        meters = []
+        mainloop = None
+
+        def meter_closed(meter):
+            meters.remove(meter)
+            if not meters:
+                logging.error("No smartmeter left")
+                mainloop.quit()
+
+        # start our main-services, a port without a meter is left out
+        for index, (port, meter) in enumerate(zip(ports, discovered)):
+            try:
+                meters.append(DbusSmlSmartmeterService(
+                    port,
+                    servicename='com.victronenergy.grid',
+                    deviceinstance=40 + index,
+                    paths=paths,
+                    private_bus=len(ports) > 1,
+                    on_close=meter_closed,
+                    discovered=meter))
+            except SmlMeterError as e:
+                logging.error(str(e))
+        if not meters:
+            sys.exit(1)
 
         logging.info(
             'Connected to dbus, and switching over to gobject.MainLoop() (= event based)')
         mainloop = gobject.MainLoop()
         mainloop.run()
+        # the last meter is gone, e.g. serial-starter probed a port without one
+        sys.exit(1)
     except Exception as e:
         logging.critical('Error at %s', 'main', exc_info=e)
         sys.exit(1)
+    finally:
+        # a probe without a meter exits before anything is published
+        profile.finish('exit')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+
+# '1-0:16.7.0*255' -> b'\x01\x00\x10\x07\x00\xff'
+def obis_to_bytes(obis):
+    a, rest = obis.split('-', 1)
+    b, rest = rest.split(':', 1)
+    c, d, rest = rest.split('.', 2)
+    e, _, f = rest.partition('*')
+    return bytes(int(x) for x in (a, b, c, d, e, f or 255))
+
+
+# Lookup table from OBIS codes to D-Bus paths, built once from config.ini.
+# The index is keyed on the exact OBIS identifier as smllib formats it
+# ('1-0:16.7.0*255'), so the value list of a frame is resolved with a single dict
+# lookup per entry, no matter how many registers are configured.
+class ObisMapping(object):
+    def __init__(self, entries):
+        # entries: iterable of (obis code, dbus path, factor)
+        self._index = {}
+        for obis, path, factor in entries:
+            if obis in self._index:
+                logging.warning(f"OBIS code {obis} mapped twice, using {path}")
+            self._index[obis] = (path, factor)
+
+    # Build the mapping from the [ObisMapping] section (or the one named mapping),
+    # lines look like
+    #   /Ac/Energy/Forward = 1-0:1.8.0*255, 0.001
+    # the optional factor is applied on top of the scaler sent by the meter. The
+    # power register configured as SmlPathOverallConsumption goes to /Ac/Power unless
+    # the section maps /Ac/Power itself. section holds the meter settings.
+    @classmethod
+    def from_config(cls, config, section='DEFAULT', mapping='ObisMapping'):
+        entries = {'/Ac/Power': (config[section]['SmlPathOverallConsumption'].strip(), 1.0)}
+        if config.has_section(mapping):
+            for path, value in config.items(mapping):
+                # DEFAULT keys show up in every section, only paths are mappings
+                if not path.startswith('/'):
+                    continue
+                obis, _, factor = value.partition(',')
+                try:
+                    obis_to_bytes(obis.strip())
+                    entries[path] = (obis.strip(), float(factor) if factor.strip() else 1.0)
+                except ValueError:
+                    logging.warning(f"Invalid OBIS mapping for {path}: {value}")
+        return cls((obis, path, factor) for path, (obis, factor) in entries.items())
+
+    # Same index keyed on the 6 raw OBIS bytes as they appear in a frame, for the
+    # fast path decoder
+    @property
+    def byte_index(self):
+        return {obis_to_bytes(obis): m for obis, m in self._index.items()}
+
+    @property
+    def paths(self):
+        return [path for path, factor in self._index.values()]
+
+    # Resolve the list entries of a frame to {dbus path: scaled value}, entries that
+    # are not configured are skipped
+    def resolve(self, obis_values):
+        index = self._index
+        values = {}
+        for list_entry in obis_values:
+            m = index.get(list_entry.obis.obis_code)
+            if m is None:
+                continue
+            value = list_entry.value
+            if not isinstance(value, (int, float)):
+                continue
+            path, factor = m
+            value *= factor
+            if list_entry.scaler:
+                value *= 10 ** list_entry.scaler
+            values[path] = value
+        return values
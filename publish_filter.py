@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+
+class Deadband(object):
+    # absolute: change in the unit of the path, relative: change as a fraction of the
+    # last published value, maxsilence: seconds after which the value is published
+    # anyway. 0 disables the respective check.
+    def __init__(self, absolute=0.0, relative=0.0, maxsilence=0.0):
+        self.absolute = absolute
+        self.relative = relative
+        self.maxsilence = maxsilence
+
+    def exceeded(self, last, value):
+        change = abs(value - last)
+        if self.absolute and change > self.absolute:
+            return True
+        if self.relative and change > self.relative * abs(last):
+            return True
+        return not self.absolute and not self.relative
+
+
+# Drops values that didn't change more than their deadband since they were last
+# published, before they reach VeDbusService. Paths without a deadband, like
+# /Ac/Power, always pass.
+class DeadbandFilter(object):
+    def __init__(self, deadbands):
+        self._deadbands = dict(deadbands)
+        # path: (value, time) as last published
+        self._published = {}
+
+    # Read the [Deadband] section (or the one named section), lines look like
+    #   /Ac/Energy/Forward = 0.01, 0, 60
+    # absolute, relative (fraction of the value) and maximum silence in seconds.
+    @classmethod
+    def from_config(cls, config, section='Deadband'):
+        deadbands = {}
+        if config.has_section(section):
+            for path, value in config.items(section):
+                # DEFAULT keys show up in every section, only paths are deadbands
+                if not path.startswith('/'):
+                    continue
+                try:
+                    deadbands[path] = Deadband(*[float(v) for v in value.split(',')])
+                except (ValueError, TypeError):
+                    logging.warning(f"Invalid deadband for {path}: {value}")
+        return cls(deadbands)
+
+    # Returns the values of {path: value} that should be published at time now
+    def apply(self, values, now):
+        if not self._deadbands:
+            return values
+        result = {}
+        for path, value in values.items():
+            deadband = self._deadbands.get(path)
+            if deadband is not None and value is not None:
+                last = self._published.get(path)
+                if last is not None and last[0] is not None:
+                    lastvalue, lasttime = last
+                    if not deadband.exceeded(lastvalue, value) and \
+                            not (deadband.maxsilence and now - lasttime >= deadband.maxsilence):
+                        continue
+            self._published[path] = (value, now)
+            result[path] = value
+        return result
+
+    # Forget what was published, e.g. after the values were invalidated
+    def reset(self):
+        self._published.clear()
+
+
+# Publish tiers: tier 0 paths go out with every frame, paths of the other tiers are
+# collected and published together later, every interval seconds or, with interval 0,
+# as soon as the mainloop has nothing else to do. Without a [PublishTiers] section
+# every path is tier 0.
+class PublishTiers(object):
+    def __init__(self, tiers, intervals, default=0):
+        self._tiers = dict(tiers)
+        # {tier: seconds between flushes}, tier 0 is never in here
+        self.intervals = dict(intervals)
+        self.default = default
+
+    # Read the [PublishTiers] section (or the one named section), lines look like
+    #   /Ac/Power = 0
+    #   Tier2 = 10
+    # paths not listed are tier 1, tiers without an interval are flushed when idle.
+    @classmethod
+    def from_config(cls, config, section='PublishTiers'):
+        if not config.has_section(section):
+            return cls({}, {})
+        tiers = {}
+        intervals = {}
+        for key, value in config.items(section):
+            try:
+                if key.startswith('/'):
+                    tiers[key] = int(value)
+                elif key.startswith('Tier') and key[4:].isdigit():
+                    intervals[int(key[4:])] = float(value)
+            except ValueError:
+                logging.warning(f"Invalid publish tier {key} = {value}")
+        for tier in set(tiers.values()) | {1}:
+            intervals.setdefault(tier, 0.0)
+        intervals.pop(0, None)
+        return cls(tiers, intervals, default=1)
+
+    def tier(self, path):
+        return self._tiers.get(path, self.default)
+
+    # The part of {path: value} that belongs to one of tiers
+    def select(self, values, tiers):
+        return {path: value for path, value in values.items() if self.tier(path) in tiers}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+# Learns when the meter sends: the period between frames and their phase, from the
+# time the last byte of every frame arrived (time.monotonic()). With that the reader
+# sleeps until just before the next frame is complete instead of polling, and a
+# frame that doesn't come is noticed about one period later instead of after a fixed
+# timeout.
+class CadenceScheduler(object):
+    # poll interval and timeout as long as the period is unknown
+    POLL = 0.5
+    TIMEOUT = 6.0
+    # read in steps this long while the expected frame is late
+    STEP = 0.02
+    # minimum time to wake up before the expected frame and to wait after it
+    LEAD = 0.05
+    MARGIN = 0.25
+    # intervals that aren't a single period in a row before the period is relearned
+    RELEARN = 4
+
+    def __init__(self, period=None):
+        self.period = period
+        # smoothed deviation of the intervals from the period
+        self.jitter = 0.0
+        self._last = None
+        self._deadline = None
+        self._outliers = 0
+
+    # A frame was complete at the given time
+    def frame(self, completed):
+        if self._last is not None:
+            self._learn(completed - self._last)
+        self._last = completed
+        self._deadline = completed + self._timeout()
+
+    def _learn(self, interval):
+        # gaps from timeouts or reconnects are no frame period
+        if not 0 < interval < self.TIMEOUT * 2:
+            return
+        if self.period is None:
+            self.period = interval
+            return
+        if abs(interval - self.period) > self.period / 2:
+            # a lost frame or a meter that changed its period
+            self._outliers += 1
+            if self._outliers >= self.RELEARN:
+                self.period = interval
+                self.jitter = 0.0
+                self._outliers = 0
+            return
+        self._outliers = 0
+        deviation = interval - self.period
+        self.period += deviation / 8
+        self.jitter += (abs(deviation) - self.jitter) / 8
+
+    def _timeout(self):
+        if self.period is None:
+            return self.TIMEOUT
+        return self.period + max(self.MARGIN, self.period / 4, 4 * self.jitter)
+
+    # Start waiting for frames from now on, after the port was (re)opened or a
+    # frame was missed. The phase is kept, the meter's clock didn't change.
+    def restart(self, now):
+        self._deadline = now + self._timeout()
+
+    # True once the next frame is later than expected
+    def overdue(self, now):
+        return self._deadline is not None and now >= self._deadline
+
+    # Seconds until the next frame is overdue
+    def until_overdue(self, now):
+        if self._deadline is None:
+            return self._timeout()
+        return max(0.0, self._deadline - now)
+
+    # Seconds to sleep before the port should be read again
+    def next_read(self, now):
+        if self.period is None or self._last is None:
+            return self.POLL
+        lead = max(self.LEAD, 2 * self.jitter)
+        # frames missed since the last one don't shift the phase
+        expected = self._last + self.period
+        if expected - lead <= now:
+            behind = int((now - expected) / self.period)
+            if now - (expected + behind * self.period) < lead + self.MARGIN:
+                # inside the window of the expected frame, keep reading
+                return self.STEP
+            expected += (behind + 1) * self.period
+        return max(self.STEP, expected - lead - now)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Fast path SML decoder.
+# Walks the TLV structure of a frame on a memoryview, only as far as needed to pull
+# out the configured OBIS registers of the GetList response. Nothing but the wanted
+# values is converted, no objects are built for skipped fields. Anything it doesn't
+# understand raises SmlDecodeError, so the caller can fall back to smllib.
+
+SML_GETLIST_RESPONSE = 0x0701
+
+_TYPE_OCTET = 0x00
+_TYPE_SIGNED = 0x50
+_TYPE_UNSIGNED = 0x60
+_TYPE_LIST = 0x70
+
+
+class SmlDecodeError(ValueError):
+    pass
+
+
+# Read a type-length field at pos. Returns (type, length, position after the field),
+# length is the number of elements for lists and the size including the TL field
+# for all other types.
+def _tl(buf, pos):
+    v = buf[pos]
+    t = v & 0x70
+    size = v & 0x0F
+    pos += 1
+    while v & 0x80:
+        v = buf[pos]
+        pos += 1
+        size = size << 4 | v & 0x0F
+    return t, size, pos
+
+
+# Skip one complete element, lists included, returns the position after it
+def _skip(buf, pos):
+    remaining = 1
+    while remaining:
+        remaining -= 1
+        start = pos
+        if buf[pos] == 0x00:
+            # end of message
+            pos += 1
+            continue
+        t, size, pos = _tl(buf, pos)
+        if t == _TYPE_LIST:
+            remaining += size
+        else:
+            pos = start + size
+    return pos
+
+
+def _read(buf, pos):
+    start = pos
+    t, size, pos = _tl(buf, pos)
+    end = start + size
+    if t == _TYPE_UNSIGNED or t == _TYPE_SIGNED:
+        return int.from_bytes(buf[pos:end], 'big', signed=t == _TYPE_SIGNED), end
+    if t == _TYPE_OCTET:
+        if end == pos:
+            # optional field not set
+            return None, end
+        return bytes(buf[pos:end]), end
+    raise SmlDecodeError(f"Unexpected type {t:02x} at {start}")
+
+
+def _expect_list(buf, pos, length):
+    t, size, pos = _tl(buf, pos)
+    if t != _TYPE_LIST or size != length:
+        raise SmlDecodeError(f"Expected list of {length} at {pos}")
+    return pos
+
+
+# Octet strings are returned like smllib does it: as text if they are readable,
+# as hex string otherwise
+def octet_value(value):
+    text = value.decode(errors='ignore')
+    return text if text.isalnum() else value.hex()
+
+
+class SmlFastDecoder(object):
+    # registers: {6 byte obis: (dbus path, factor)}
+    # identity: {6 byte obis: name}, octet registers returned on request
+    def __init__(self, registers, identity=None):
+        self._registers = dict(registers)
+        self._identity = dict(identity or {})
+
+    # Decode a frame payload (the unescaped messages between start and end escape
+    # sequence, SmlFrame.buffer). Returns ({dbus path: value}, {name: value}), the
+    # identity dict is only filled with with_identity set.
+    def decode(self, payload, with_identity=False):
+        buf = payload if isinstance(payload, memoryview) else memoryview(payload)
+        try:
+            return self._decode(buf, with_identity)
+        except IndexError:
+            raise SmlDecodeError("Frame truncated")
+
+    def _decode(self, buf, with_identity):
+        registers = self._registers
+        identity = self._identity if with_identity else {}
+        values = {}
+        ident = {}
+        found = False
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            if buf[pos] == 0x00:
+                # padding
+                pos += 1
+                continue
+            # message: transactionId, groupNo, abortOnError, body, crc, endOfMessage
+            pos = _expect_list(buf, pos, 6)
+            pos = _skip(buf, pos)
+            pos = _skip(buf, pos)
+            pos = _skip(buf, pos)
+            pos = _expect_list(buf, pos, 2)
+            tag, pos = _read(buf, pos)
+            if tag != SML_GETLIST_RESPONSE:
+                pos = _skip(buf, pos)
+            else:
+                found = True
+                # clientId, serverId, listName, actSensorTime, valList, listSignature, actGatewayTime
+                pos = _expect_list(buf, pos, 7)
+                for i in range(4):
+                    pos = _skip(buf, pos)
+                t, entries, pos = _tl(buf, pos)
+                if t != _TYPE_LIST:
+                    raise SmlDecodeError(f"Expected value list at {pos}")
+                for i in range(entries):
+                    # objName, status, valTime, unit, scaler, value, valueSignature
+                    pos = _expect_list(buf, pos, 7)
+                    obis, pos = _read(buf, pos)
+                    register = registers.get(obis)
+                    if register is None:
+                        name = identity.get(obis)
+                        if name is None:
+                            # not wanted, skip the 6 remaining fields
+                            for j in range(6):
+                                pos = _skip(buf, pos)
+                            continue
+                        for j in range(4):
+                            pos = _skip(buf, pos)
+                        value, pos = _read(buf, pos)
+                        if isinstance(value, bytes):
+                            value = octet_value(value)
+                        ident[name] = value
+                        pos = _skip(buf, pos)
+                        continue
+
+                    pos = _skip(buf, pos)
+                    pos = _skip(buf, pos)
+                    pos = _skip(buf, pos)
+                    scaler, pos = _read(buf, pos)
+                    value, pos = _read(buf, pos)
+                    pos = _skip(buf, pos)
+                    if not isinstance(value, int):
+                        continue
+                    path, factor = register
+                    value *= factor
+                    if scaler:
+                        value *= 10 ** scaler
+                    values[path] = value
+                pos = _skip(buf, pos)
+                pos = _skip(buf, pos)
+            # crc, endOfMessage
+            pos = _skip(buf, pos)
+            if buf[pos] != 0x00:
+                raise SmlDecodeError(f"Expected end of message at {pos}")
+            pos += 1
+
+        if not found:
+            raise SmlDecodeError("No GetList response in frame")
+        return values, ident
+
+
+# Fingerprint of what the meter measured: objName, scaler and value of every GetList
+# entry, joined as raw bytes. Transaction ids, status words, timestamps (valTime,
+# actSensorTime, actGatewayTime), signatures and CRCs are left out, so two frames
+# that only differ in counters and seconds index have the same fingerprint. Nothing
+# is converted, so it is a lot cheaper than smllib, but it walks the frame like
+# SmlFastDecoder does and costs about the same. With the fast decoder the decoded
+# values are compared instead.
+def value_fingerprint(payload):
+    buf = payload if isinstance(payload, memoryview) else memoryview(payload)
+    try:
+        return _fingerprint(buf)
+    except IndexError:
+        raise SmlDecodeError("Frame truncated")
+
+
+def _fingerprint(buf):
+    parts = []
+    found = False
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        if buf[pos] == 0x00:
+            pos += 1
+            continue
+        pos = _expect_list(buf, pos, 6)
+        for i in range(3):
+            pos = _skip(buf, pos)
+        pos = _expect_list(buf, pos, 2)
+        tag, pos = _read(buf, pos)
+        if tag != SML_GETLIST_RESPONSE:
+            pos = _skip(buf, pos)
+        else:
+            found = True
+            pos = _expect_list(buf, pos, 7)
+            for i in range(4):
+                pos = _skip(buf, pos)
+            t, entries, pos = _tl(buf, pos)
+            if t != _TYPE_LIST:
+                raise SmlDecodeError(f"Expected value list at {pos}")
+            for i in range(entries):
+                pos = _expect_list(buf, pos, 7)
+                # objName
+                start = pos
+                pos = _skip(buf, pos)
+                parts.append(buf[start:pos])
+                # status, valTime, unit
+                for j in range(3):
+                    pos = _skip(buf, pos)
+                # scaler, value
+                start = pos
+                pos = _skip(buf, _skip(buf, pos))
+                parts.append(buf[start:pos])
+                # valueSignature
+                pos = _skip(buf, pos)
+            pos = _skip(buf, pos)
+            pos = _skip(buf, pos)
+        pos = _skip(buf, pos)
+        if buf[pos] != 0x00:
+            raise SmlDecodeError(f"Expected end of message at {pos}")
+        pos += 1
+
+    if not found:
+        raise SmlDecodeError("No GetList response in frame")
+    return b''.join(parts)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import logging
+import os
+import selectors
+import termios
+import time
+
+from serial import SerialException
+
+from sml_pipeline import SmlFramePipeline
+from sml_serial import open_port
+
+CANDIDATES = ('/dev/ttyUSB*', '/dev/ttyACM*')
+
+
+# A port that sent a valid SML frame. The port stays open, the pipeline holds
+# whatever arrived after the frame.
+class DiscoveredMeter(object):
+    def __init__(self, port, serial_port, pipeline, frame):
+        self.port = port
+        self.serial_port = serial_port
+        self.pipeline = pipeline
+        self.frame = frame
+
+
+def candidate_ports(patterns=CANDIDATES):
+    ports = []
+    for pattern in patterns:
+        ports += sorted(glob.glob(pattern))
+    return ports
+
+
+# Ports some process has open, from /proc like fuser does. Ports that serialbattery,
+# VE.Direct or BMS drivers hold are left alone.
+def ports_in_use():
+    own = '/proc/%d/fd' % os.getpid()
+    used = set()
+    for fds in glob.glob('/proc/[0-9]*/fd'):
+        if fds == own:
+            continue
+        try:
+            names = os.listdir(fds)
+        except OSError:
+            continue
+        for name in names:
+            try:
+                used.add(os.readlink(os.path.join(fds, name)))
+            except OSError:
+                pass
+    return used
+
+
+# termios settings of a port before the probe changes them, None if unknown
+def _line_settings(port):
+    try:
+        fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        return termios.tcgetattr(fd)
+    except termios.error:
+        return None
+    finally:
+        os.close(fd)
+
+
+# Close a probed port that isn't taken, with the settings it had before
+def _release(serial_port, settings):
+    if settings is not None:
+        try:
+            termios.tcsetattr(serial_port.fileno(), termios.TCSANOW, settings)
+        except (termios.error, OSError):
+            pass
+    serial_port.close()
+
+
+# Probe all ports at the same time instead of one after the other: every port is
+# opened without blocking at the configured baudrate and framing and watched for
+# bytes, each one gets its own frame pipeline. Ports another process has open are
+# skipped, the others are opened with an exclusive lock and get their old line
+# settings back if no meter is found. A port is taken with its first frame that
+# passes the CRC check. Once a meter is
+# found the others get `settle` more seconds, meters send at about the same pace,
+# so detection takes about one meter period instead of a full timeout per port. Returns the meters found, sorted by port.
+def discover(ports, timeout=6.0, settle=2.0, baudrate=9600, framing='8N1'):
+    selector = selectors.DefaultSelector()
+    probing = {}
+    used = ports_in_use()
+    for port in ports:
+        if os.path.realpath(port) in used:
+            logging.info(f"Skipping {port} in discovery, it is in use")
+            continue
+        settings = _line_settings(port)
+        serial_port = open_port(port, baudrate, timeout=0, framing=framing, exclusive=True)
+        if serial_port is None:
+            continue
+        selector.register(serial_port.fileno(), selectors.EVENT_READ, port)
+        probing[port] = (serial_port, SmlFramePipeline(), settings)
+
+    found = []
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        while probing:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            for key, events in selector.select(deadline - now):
+                port = key.data
+                serial_port, pipeline, settings = probing[port]
+                try:
+                    data = serial_port.read(max(1, serial_port.in_waiting))
+                except (SerialException, OSError) as e:
+                    logging.info(f"Dropping {port} from discovery: {e}")
+                    selector.unregister(key.fileobj)
+                    del probing[port]
+                    _release(serial_port, settings)
+                    continue
+
+                for frame in pipeline.feed(data):
+                    selector.unregister(key.fileobj)
+                    del probing[port]
+                    serial_port.timeout = 1
+                    found.append(DiscoveredMeter(port, serial_port, pipeline, frame))
+                    logging.info(f"Found smartmeter on {port} after {time.monotonic() - start:.1f}s")
+                    deadline = min(deadline, time.monotonic() + settle)
+                    break
+    finally:
+        for serial_port, pipeline, settings in probing.values():
+            _release(serial_port, settings)
+        selector.close()
+    return sorted(found, key=lambda meter: meter.port)
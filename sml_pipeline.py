@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+ESCAPE = b'\x1b\x1b\x1b\x1b'
+START = ESCAPE + b'\x01\x01\x01\x01'
+END = ESCAPE + b'\x1a'
+
+
+# CRC16 X25 as used by SML, same as smllib.crc.x25 but computed in steps
+def _crc16_x25_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+CRC16_X25_TABLE = _crc16_x25_table()
+
+
+def crc16_x25_update(crc, data):
+    table = CRC16_X25_TABLE
+    for byte in data:
+        crc = table[(byte ^ crc) & 0xff] ^ (crc >> 8)
+    return crc
+
+
+# The value as it is sent at the end of the frame
+def crc16_x25_final(crc):
+    crc ^= 0xffff
+    return (crc & 0xff) << 8 | crc >> 8
+
+
+# smllib is only imported once a frame is actually parsed with it, with Decoder=fast
+# it is never loaded
+_build_ctx = None
+
+
+def _smllib_frame(buffer, msg_ctx):
+    global _build_ctx
+    from smllib.sml_frame import SmlFrame
+    if _build_ctx is None:
+        from smllib.builder import create_context
+        _build_ctx = create_context()
+    return SmlFrame(buffer, build_ctx=_build_ctx, msg_ctx=msg_ctx)
+
+
+# Received frame that knows when its first byte arrived, when its last byte arrived
+# and when the CRC was checked (time.monotonic()). Offers the SmlFrame interface the
+# driver uses, the smllib frame behind it is built on first use.
+class TimedSmlFrame(object):
+    def __init__(self, buffer, msg_ctx, received, completed, checked):
+        self.bytes = buffer
+        self.buffer = memoryview(buffer)
+        self.msg_ctx = msg_ctx
+        self.received = received
+        self.completed = completed
+        self.checked = checked
+        self._frame = None
+
+    def _smllib(self):
+        if self._frame is None:
+            self._frame = _smllib_frame(self.bytes, self.msg_ctx)
+        return self._frame
+
+    def get_obis(self):
+        return self._smllib().get_obis()
+
+    def parse_frame(self):
+        return self._smllib().parse_frame()
+
+
+# Long lived frame pipeline for one serial port.
+# The receive buffer lives as long as the service, so bytes of a half received
+# frame are kept between reads and the frame completes with the next chunk instead
+# of being thrown away.
+# Every chunk is only scanned once: the search for escape sequences continues from
+# where the last one stopped, and the CRC is updated with the new bytes while they
+# arrive. A frame is accepted or rejected as soon as its last byte is in, and a noisy
+# link never makes us rescan what we've already seen.
+class SmlFramePipeline(object):
+    MAX_SIZE = 50 * 1024
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # arrival time of the last chunk and of the first byte of the current frame
+        self._rxtime = 0
+        self._received = 0
+        self._reset()
+        self.frames = 0
+        self.crc_errors = 0
+        self.bytes_received = 0
+
+    def _reset(self):
+        # no frame start seen yet, the buffer holds at most a partial start sequence
+        self._started = False
+        # next position to search for escape sequences
+        self._scan = 0
+        # CRC of the frame bytes before self._crcpos
+        self._crc = 0xffff
+        self._crcpos = 0
+
+    # Add received bytes and yield every frame that is complete now. Frames that are
+    # not consumed stay buffered and are returned by the next call, feed(b'') just
+    # returns what is already buffered.
+    def feed(self, data):
+        if data:
+            self._rxtime = time.monotonic()
+            self.bytes_received += len(data)
+            self._buffer += data
+
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return
+            if frame is not False:
+                self.frames += 1
+                yield frame
+
+    # Returns the next complete frame, None if more bytes are needed and False if a
+    # frame was dropped
+    def _next_frame(self):
+        buf = self._buffer
+        if not self._started:
+            start = buf.find(START, self._scan)
+            if start == -1:
+                # keep what could be the beginning of a start sequence
+                del buf[:max(0, len(buf) - len(START) + 1)]
+                self._scan = 0
+                return None
+            del buf[:start]
+            self._started = True
+            self._received = self._rxtime
+            self._scan = len(START)
+            self._crc = crc16_x25_update(0xffff, START)
+            self._crcpos = len(START)
+
+        # nothing that could be an escape sequence in the new bytes, just update the CRC
+        scan = self._scan
+        if buf.find(ESCAPE, scan) == -1:
+            if self._too_long():
+                return False
+            self._scan = max(len(START), len(buf) - len(START) + 1)
+            self._update_crc(len(buf))
+            return None
+
+        # search from the last position, minus what could be a partial end sequence
+        end = scan
+        while True:
+            end = buf.find(END, end)
+            if end == -1 or buf[end - 4:end] != ESCAPE:
+                break
+            # escaped data, not the end
+            end += 1
+
+        # a frame that was cut off is followed by a new start sequence
+        restart = buf.find(START, scan, end if end != -1 else len(buf))
+        if restart != -1 and buf[restart - 4:restart] != ESCAPE:
+            logging.info("SML frame incomplete")
+            del buf[:restart]
+            self._reset()
+            return False
+
+        if end == -1:
+            if self._too_long():
+                return False
+            # keep what could be a partial start or end sequence for the next search
+            self._scan = max(len(START), len(buf) - len(START) + 1)
+            self._update_crc(len(buf))
+            return None
+
+        # end sequence, padding count, 2 bytes CRC
+        if len(buf) < end + 8:
+            self._scan = end
+            self._update_crc(min(len(buf), end + 6))
+            return None
+
+        self._update_crc(end + 6)
+        crc_msg = buf[end + 6] << 8 | buf[end + 7]
+        crc_calc = crc16_x25_final(self._crc)
+        padding = buf[end + 5]
+        msg = bytes(buf[:end + 8])
+        del buf[:end + 8]
+        self._reset()
+        if crc_msg != crc_calc or padding > 3:
+            logging.info("CRC Error")
+            self.crc_errors += 1
+            return False
+
+        frame = msg[len(START): end - padding].replace(ESCAPE + ESCAPE, ESCAPE)
+        return TimedSmlFrame(frame, msg, self._received, self._rxtime, time.monotonic())
+
+    # A frame without end that outgrew MAX_SIZE is dropped
+    def _too_long(self):
+        if len(self._buffer) <= self.MAX_SIZE:
+            return False
+        logging.info("SML frame too long")
+        del self._buffer[:]
+        self._reset()
+        return True
+
+    def _update_crc(self, pos):
+        if pos > self._crcpos:
+            self._crc = crc16_x25_update(self._crc, self._buffer[self._crcpos:pos])
+            self._crcpos = pos
+
+    # Drop everything buffered, e.g. after the port was reopened
+    def clear(self):
+        del self._buffer[:]
+        self._reset()
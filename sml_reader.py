@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import traceback
+
+from serial import SerialException
+
+
+# Single slot handoff between the reader thread and the mainloop. Only the newest
+# value is kept, an older one that was not taken yet is simply replaced. notify is
+# called whenever the slot goes from empty to full, so the mainloop gets woken up
+# once per value it can take and never has to work through a queue.
+class LatestValue(object):
+    def __init__(self, notify):
+        self._lock = threading.Lock()
+        self._notify = notify
+        self._value = None
+        self._full = False
+        self.replaced = 0
+
+    # Returns True if a value that was never taken got replaced
+    def put(self, value):
+        with self._lock:
+            wasfull = self._full
+            if wasfull:
+                self.replaced += 1
+            self._value = value
+            self._full = True
+        if not wasfull:
+            self._notify()
+        return wasfull
+
+    def take(self):
+        with self._lock:
+            value = self._value
+            self._value = None
+            self._full = False
+        return value
+
+
+# Decode the newest of the frames that piled up while nobody was reading, the older
+# ones are stale once there is a newer reading and aren't decoded at all. Returns the
+# reading (None if no frame was valid) and the number of stale frames skipped.
+def newest_reading(frames, decode):
+    for i in range(len(frames) - 1, -1, -1):
+        meter_data = decode(frames[i])
+        if meter_data:
+            return meter_data, i
+    return None, 0
+
+
+# Background thread that owns the serial port and the frame pipeline. Reading, CRC
+# checks and decoding run here, the mainloop only gets the decoded readings through
+# the handoff and stays free to answer D-Bus calls while the IR head is slow.
+class SmlReaderThread(threading.Thread):
+    # on_error is called from the thread for every failed read
+    def __init__(self, serial_port, pipeline, decode, handoff, on_error=None):
+        threading.Thread.__init__(self, name='sml-reader')
+        self.daemon = True
+        self._serial_port = serial_port
+        self._pipeline = pipeline
+        self._decode = decode
+        self._handoff = handoff
+        self._on_error = on_error
+        self._quit = threading.Event()
+        # frames that were never published because a newer one came in
+        self.stale = 0
+
+    def run(self):
+        while not self._quit.is_set():
+            try:
+                # blocks until bytes arrive or the port timeout expires
+                s = self._serial_port.read(max(1, self._serial_port.inWaiting()))
+            except SerialException as e:
+                if self._quit.is_set():
+                    break
+                logging.warning(traceback.format_exc())
+                if self._on_error is not None:
+                    self._on_error()
+                self._quit.wait(1)
+                continue
+
+            meter_data, stale = newest_reading(list(self._pipeline.feed(s)), self._decode)
+            self.stale += stale
+            if meter_data and self._handoff.put(meter_data):
+                # the mainloop didn't get around to the previous reading
+                self.stale += 1
+
+    def stop(self):
+        self._quit.set()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+
+import serial
+from serial import SerialException
+
+from sml_cadence import CadenceScheduler
+from sml_pipeline import SmlFramePipeline, START
+
+# line settings tried by detect_line, most common first
+LINE_CANDIDATES = (
+    (9600, '8N1'), (19200, '8N1'), (38400, '8N1'), (57600, '8N1'), (115200, '8N1'),
+    (4800, '8N1'), (2400, '8N1'), (9600, '8E1'), (9600, '8N2'),
+)
+# pause in seconds that ends a transmission of the meter during detect_line
+DETECT_GAP = 0.5
+
+
+# Framing like '8N1' as pyserial arguments
+def framing_settings(framing):
+    stopbits = float(framing[2:])
+    return {
+        'bytesize': int(framing[0]),
+        'parity': framing[1].upper(),
+        'stopbits': int(stopbits) if stopbits.is_integer() else stopbits,
+    }
+
+
+# Open the serial port of an IR head, returns None if that is not possible right now.
+# exclusive=True takes an advisory lock, it fails if another process holds one.
+def open_port(port, baudrate=9600, timeout=1, framing='8N1', exclusive=None):
+    try:
+        serial_port = serial.Serial(port, baudrate, timeout=timeout, exclusive=exclusive,
+                                    **framing_settings(framing))
+    except (SerialException, OSError) as e:
+        logging.warning(f"Can't open serial port {port}: {e}")
+        return None
+    if not serial_port.is_open:
+        logging.warning(f"Can't open serial port {port}")
+        return None
+    return serial_port
+
+
+# Exponential backoff for reconnect attempts: initial, 2*initial, 4*initial, ...
+# up to maximum seconds, until reset() after a successful reconnect
+class Backoff(object):
+    def __init__(self, initial=1.0, maximum=60.0):
+        self.initial = initial
+        self.maximum = maximum
+        self._delay = initial
+
+    def next(self):
+        delay = self._delay
+        self._delay = min(self.maximum, self._delay * 2)
+        return delay
+
+    def reset(self):
+        self._delay = self.initial
+
+
+# Find the baud rate and framing an IR head runs at by listening to it with every
+# candidate setting. A candidate scores by the frames that pass the CRC check, their
+# share of all frames and the SML start sequences seen. The first candidate with a
+# clean frame is taken right away, so a meter at the common setting costs one frame.
+# A candidate is given up once a complete transmission (bytes between two pauses of
+# GAP seconds) brought no frame, or after window seconds from its first byte, so
+# meters sending every few seconds are judged on a whole frame. A head that sends
+# nothing for silence seconds is silent at every setting. Leaves the port at the best
+# setting and returns (baudrate, framing), None if nothing looked like SML.
+def detect_line(serial_port, candidates=LINE_CANDIDATES, window=CadenceScheduler.TIMEOUT,
+                silence=CadenceScheduler.TIMEOUT):
+    best = None
+    bestscore = (0, 0, 0)
+    timeout = serial_port.timeout
+    # short reads, pauses between transmissions have to be noticed
+    serial_port.timeout = DETECT_GAP / 2
+    try:
+        for baudrate, framing in candidates:
+            serial_port.baudrate = baudrate
+            for name, value in framing_settings(framing).items():
+                setattr(serial_port, name, value)
+            serial_port.reset_input_buffer()
+
+            pipeline = SmlFramePipeline()
+            received = bytearray()
+            frames = 0
+            deadline = time.monotonic() + silence
+            # time of the last bytes, and whether a transmission started after a pause
+            lastrx = None
+            started = False
+            while frames == 0:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                try:
+                    data = serial_port.read(max(1, serial_port.in_waiting))
+                except SerialException as e:
+                    logging.warning(f"Line detection failed: {e}")
+                    return None
+                now = time.monotonic()
+                if not data:
+                    if started and now - lastrx >= DETECT_GAP:
+                        # a whole transmission at this setting and no frame in it
+                        break
+                    continue
+                if lastrx is None:
+                    deadline = now + window
+                elif now - lastrx >= DETECT_GAP:
+                    started = True
+                lastrx = now
+                received += data
+                frames += sum(1 for frame in pipeline.feed(data))
+
+            if not received:
+                # a silent head is silent at every speed
+                logging.info(f"Nothing received at {baudrate} {framing}")
+                return None
+            score = (frames, frames / (frames + pipeline.crc_errors) if frames else 0, received.count(START))
+            logging.info(f"{baudrate} {framing}: {frames} frames, {pipeline.crc_errors} CRC errors, {score[2]} start sequences")
+            if frames and not pipeline.crc_errors:
+                return baudrate, framing
+            if score > bestscore:
+                best, bestscore = (baudrate, framing), score
+
+        if best is not None:
+            serial_port.baudrate = best[0]
+            for name, value in framing_settings(best[1]).items():
+                setattr(serial_port, name, value)
+        return best
+    finally:
+        serial_port.timeout = timeout
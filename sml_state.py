@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import re
+
+from sml_cadence import CadenceScheduler
+
+FRAMING = re.compile(r'[5-8][NEOMS](1|1\.5|2)$')
+
+
+# Small JSON file per port with what we learned about the meter: identity, last
+# energy counters and frame timing. It lets the next start register on D-Bus right
+# away instead of waiting for an identification frame.
+def load_state(filename):
+    try:
+        with open(filename) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict):
+        return {}
+    return _checked(state, filename)
+
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# The entries of a state that can be used, anything broken or out of range is left
+# out and learned again
+def _checked(state, filename):
+    checked = {}
+    serial = state.get('serial')
+    if isinstance(serial, str) and serial.strip():
+        checked['serial'] = serial
+    period = state.get('period')
+    # same range the cadence scheduler learns periods in
+    if _number(period) and 0 < period < CadenceScheduler.TIMEOUT * 2:
+        checked['period'] = period
+    line = state.get('line')
+    if isinstance(line, list) and len(line) == 2 and isinstance(line[0], int) and \
+            not isinstance(line[0], bool) and line[0] > 0 and \
+            isinstance(line[1], str) and FRAMING.match(line[1]):
+        checked['line'] = line
+    values = state.get('values')
+    if isinstance(values, dict):
+        checked['values'] = {path: value for path, value in values.items() if _number(value)}
+    for key in state:
+        if key in ('serial', 'period', 'line', 'values') and key not in checked and state[key] is not None:
+            logging.warning(f"Ignoring invalid {key} in {filename}: {state[key]!r}")
+    return checked
+
+
+def save_state(filename, state):
+    # write a new file and rename it, a power cut never leaves a half written state
+    tmp = filename + '.tmp'
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, filename)
+    except OSError as e:
+        logging.warning(f"Can't save state to {filename}: {e}")
+
+
+# Forget the meter on a port, the next start identifies it from scratch
+def remove_state(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Can't remove state {filename}: {e}")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+
+# Rolling window of latency samples in seconds. Adding a sample is a deque append,
+# the percentiles are only computed when the statistics are exported.
+class LatencyWindow(object):
+    def __init__(self, size=100):
+        self._samples = deque(maxlen=size)
+        self.last = None
+
+    def add(self, value):
+        self._samples.append(value)
+        self.last = value
+
+    def maximum(self):
+        return max(self._samples) if self._samples else None
+
+    def percentile(self, p):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+# Per frame latencies and counters of one meter, exported under /Mgmt on D-Bus.
+#   Receive: first byte to last byte of a frame, the time on the wire
+#   Decode:  last byte to decoded values
+#   Publish: last byte to the values being on D-Bus, the age of /Ac/Power
+class FrameStatistics(object):
+    STAGES = ('Receive', 'Decode', 'Publish')
+
+    def __init__(self, window=100):
+        self._latency = {stage: LatencyWindow(window) for stage in self.STAGES}
+        self.timeouts = 0
+        # frames skipped because a newer one was already there
+        self.stale = 0
+        # frames skipped because their values were the same as the last ones
+        self.unchanged = 0
+
+    # timing: (received, completed, checked, decoded) of the frame, published: when
+    # its values went out, all time.monotonic()
+    def frame_published(self, timing, published):
+        received, completed, checked, decoded = timing
+        self._latency['Receive'].add(completed - received)
+        self._latency['Decode'].add(decoded - completed)
+        self._latency['Publish'].add(published - completed)
+
+    @staticmethod
+    def paths():
+        paths = ['/Mgmt/Stats/Frames', '/Mgmt/Stats/CrcErrors', '/Mgmt/Stats/Timeouts', '/Mgmt/Stats/BytesReceived',
+                 '/Mgmt/Stats/StaleFrames', '/Mgmt/Stats/UnchangedFrames']
+        for stage in FrameStatistics.STAGES:
+            paths += ['/Mgmt/Latency/%s/%s' % (stage, n) for n in ('Last', 'P50', 'P95', 'Max')]
+        return paths
+
+    # {path: value} for all statistics, latencies in milliseconds
+    def values(self, pipeline):
+        def ms(v): return None if v is None else round(v * 1000, 1)
+
+        values = {
+            '/Mgmt/Stats/Frames': pipeline.frames,
+            '/Mgmt/Stats/CrcErrors': pipeline.crc_errors,
+            '/Mgmt/Stats/Timeouts': self.timeouts,
+            '/Mgmt/Stats/BytesReceived': pipeline.bytes_received,
+            '/Mgmt/Stats/StaleFrames': self.stale,
+            '/Mgmt/Stats/UnchangedFrames': self.unchanged,
+        }
+        for stage, window in self._latency.items():
+            values['/Mgmt/Latency/%s/Last' % stage] = ms(window.last)
+            values['/Mgmt/Latency/%s/P50' % stage] = ms(window.percentile(0.5))
+            values['/Mgmt/Latency/%s/P95' % stage] = ms(window.percentile(0.95))
+            values['/Mgmt/Latency/%s/Max' % stage] = ms(window.maximum())
+        return values
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+# Measured startup: time spent in imports and initialisation steps, printed to stderr
+# in the style of python -X importtime, so startup cost can be compared between
+# versions. Enabled with --profile-startup on the command line or
+# SML_PROFILE_STARTUP=1 in the environment, costs nothing otherwise.
+class StartupProfile(object):
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._start = time.perf_counter()
+        # [name, start, time spent in nested phases]
+        self._stack = []
+        self._lines = []
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        entry = [name, time.perf_counter(), 0.0]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            total = time.perf_counter() - entry[1]
+            if self._stack:
+                self._stack[-1][2] += total
+            self._lines.append((len(self._stack), total - entry[2], total, name))
+
+    # Record a point in time, e.g. the first published value
+    def mark(self, name):
+        if self.enabled:
+            self._lines.append((None, None, time.perf_counter() - self._start, name))
+
+    def report(self, out=None):
+        if not self.enabled:
+            return
+        out = out or sys.stderr
+        out.write('startup time: self [us] | cumulative | phase\n')
+        for depth, own, total, name in self._lines:
+            if depth is None:
+                out.write('startup time: %9s | %10d | %s (since start)\n' % ('', total * 1e6, name))
+            else:
+                out.write('startup time: %9d | %10d | %s%s\n' % (own * 1e6, total * 1e6, '  ' * depth, name))
+        out.flush()
+        self._lines = []
+
+    # Report what wasn't reported yet, marked with name, e.g. when the process exits
+    # before the first value was published
+    def finish(self, name):
+        if self.enabled and self._lines:
+            self.mark(name)
+            self.report()
+
+
+profile = StartupProfile('--profile-startup' in sys.argv or bool(os.environ.get('SML_PROFILE_STARTUP')))
@@ -232,6 +232,31 @@ def wrap_dbus_value(value):
 	return value
 
 
+# Wrapper for the values of a path with a fixed type, chosen once when the path is
+# added instead of going through the isinstance chain of wrap_dbus_value with every
+# value. Paths without a type, or a type not handled here, get wrap_dbus_value.
+def typed_dbus_wrapper(valuetype):
+	if valuetype is int:
+		def wrap_int(value):
+			if value is None:
+				return VEDBUS_INVALID
+			try:
+				return dbus.Int32(value, variant_level=1)
+			except OverflowError:
+				return dbus.Int64(value, variant_level=1)
+		return wrap_int
+
+	dbustype = {float: dbus.Double, bool: dbus.Boolean, str: dbus.String}.get(valuetype)
+	if dbustype is None:
+		return wrap_dbus_value
+
+	def wrap(value):
+		if value is None:
+			return VEDBUS_INVALID
+		return dbustype(value, variant_level=1)
+	return wrap
+
+
 dbus_int_types = (dbus.Int32, dbus.UInt32, dbus.Byte, dbus.Int16, dbus.UInt16, dbus.UInt32, dbus.Int64, dbus.UInt64)
 
 
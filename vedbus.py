@@ -6,8 +6,9 @@ import logging
 import traceback
 import os
 import weakref
+from bisect import bisect_left, insort
 from collections import defaultdict
-from ve_utils import wrap_dbus_value, unwrap_dbus_value
+from ve_utils import wrap_dbus_value, unwrap_dbus_value, typed_dbus_wrapper
 
 # vedbus contains three classes:
 # VeDbusItemImport -> use this to read data from the dbus, ie import
@@ -56,14 +57,41 @@ from ve_utils import wrap_dbus_value, unwrap_dbus_value
 
 #   The signature of a variant is 'v'.
 
+# When VeDbusItemExport formats the Text of a value:
+# eager:  with every change, every signal carries Value and Text (default)
+# cached: with every change, but each distinct value is formatted only once. Only
+#         pays off for values that recur (states, settings), a changing
+#         measurement is a new value nearly every time and only adds the lookup.
+# lazy:   only when GetText or GetItems asks for it, signals carry the Value only.
+#         VeDbusItemImport falls back to str(value), so only use it for paths
+#         whose consumers don't show the Text.
+TEXT_EAGER = 'eager'
+TEXT_CACHED = 'cached'
+TEXT_LAZY = 'lazy'
+TEXT_CACHE_SIZE = 64
+
 # Export ourselves as a D-Bus service.
 class VeDbusService(object):
-	def __init__(self, servicename, bus=None):
+	# textpolicy: default text policy for the paths of this service, see above
+	def __init__(self, servicename, bus=None, register=True, textpolicy=TEXT_EAGER):
 		# dict containing the VeDbusItemExport objects, with their path as the key.
 		self._dbusobjects = {}
+		# the same paths, sorted, so the paths below a node are one slice
+		self._sortedpaths = []
+
+		# GetItems result, kept between calls. Every local value change bumps _version
+		# and marks its path dirty, only dirty paths are wrapped and formatted again.
+		self._version = 0
+		self._snapshot = None
+		self._snapshotversion = -1
+		self._dirtypaths = set()
 		self._dbusnodes = {}
+		# number of items below each node, a node is removed with its last item
+		self._nodeitems = {}
 		self._ratelimiters = []
 		self._dbusname = None
+		self.name = servicename
+		self._textpolicy = textpolicy
 
 		# dict containing the onchange callbacks, for each object. Object path is the key
 		self._onchangecallbacks = {}
@@ -74,13 +102,18 @@ class VeDbusService(object):
 		# make the dbus connection available to outside, could make this a true property instead, but ach..
 		self.dbusconn = self._dbusconn
 
-		# Register ourselves on the dbus, trigger an error if already in use (do_not_queue)
-		self._dbusname = dbus.service.BusName(servicename, self._dbusconn, do_not_queue=True)
-
 		# Add the root item that will return all items as a tree
 		self._dbusnodes['/'] = VeDbusRootExport(self._dbusconn, '/', self)
 
-		logging.info("registered ourselves on D-Bus as %s" % servicename)
+		# Pass register=False to add all paths first and call register() when done, so
+		# nobody sees the service before it is complete
+		if register:
+			self.register()
+
+	def register(self):
+		# Register ourselves on the dbus, trigger an error if already in use (do_not_queue)
+		self._dbusname = dbus.service.BusName(self.name, self._dbusconn, do_not_queue=True)
+		logging.info("registered ourselves on D-Bus as %s" % self.name)
 
 	# To force immediate deregistering of this dbus service and all its object paths, explicitly
 	# call __del__().
@@ -88,9 +121,12 @@ class VeDbusService(object):
 		for node in list(self._dbusnodes.values()):
 			node.__del__()
 		self._dbusnodes.clear()
-		for item in list(self._dbusobjects.values()):
-			item.__del__()
+		self._nodeitems.clear()
+		items = list(self._dbusobjects.values())
 		self._dbusobjects.clear()
+		del self._sortedpaths[:]
+		for item in items:
+			item.__del__()
 		if self._dbusname:
 			self._dbusname.__del__()  # Forces call to self._bus.release_name(self._name), see source code
 		self._dbusname = None
@@ -98,22 +134,27 @@ class VeDbusService(object):
 	# @param callbackonchange	function that will be called when this value is changed. First parameter will
 	#							be the path of the object, second the new value. This callback should return
 	#							True to accept the change, False to reject it.
+	# @param textpolicy		when Text is formatted for this path, None for the policy of the service.
 	def add_path(self, path, value, description="", writeable=False,
-					onchangecallback=None, gettextcallback=None, valuetype=None):
+					onchangecallback=None, gettextcallback=None, valuetype=None, textpolicy=None):
 
 		if onchangecallback is not None:
 			self._onchangecallbacks[path] = onchangecallback
 
 		item = VeDbusItemExport(
 				self._dbusconn, path, value, description, writeable,
-				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype)
+				self._value_changed, gettextcallback, deletecallback=self._item_deleted, valuetype=valuetype,
+				textpolicy=textpolicy or self._textpolicy, localchangecallback=self._local_changed)
 
-		spl = path.split('/')
-		for i in range(2, len(spl)):
-			subPath = '/'.join(spl[:i])
+		for subPath in self._ancestors(path):
 			if subPath not in self._dbusnodes and subPath not in self._dbusobjects:
 				self._dbusnodes[subPath] = VeDbusTreeExport(self._dbusconn, subPath, self)
+		if path not in self._dbusobjects:
+			insort(self._sortedpaths, path)
+			for subPath in self._ancestors(path):
+				self._nodeitems[subPath] = self._nodeitems.get(subPath, 0) + 1
 		self._dbusobjects[path] = item
+		self._local_changed(path)
 		logging.debug('added %s with start value %s. Writeable is %s' % (path, value, writeable))
 
 	# Add the mandatory paths, as per victron dbus api doc
@@ -139,16 +180,87 @@ class VeDbusService(object):
 
 		return self._onchangecallbacks[path](path, newvalue)
 
+	# Paths of the items below a node, in sorted order. All of them start with
+	# prefix (the node path plus '/'), so they lie between prefix and the same
+	# string with the trailing '/' replaced by the next character, '0'.
+	def _subtree_paths(self, prefix):
+		paths = self._sortedpaths
+		return paths[bisect_left(paths, prefix):bisect_left(paths, prefix[:-1] + '0')]
+
+	# Called by the items for every change of their value
+	def _local_changed(self, path):
+		self._version += 1
+		self._dirtypaths.add(path)
+
+	# {path: {'Value': wrapped value, 'Text': text}} of all items, for GetItems
+	def _items_snapshot(self):
+		if self._snapshotversion == self._version:
+			return self._snapshot
+		if self._snapshot is None:
+			paths = self._dbusobjects.keys()
+			self._snapshot = {}
+		else:
+			paths = self._dirtypaths
+		for path in paths:
+			item = self._dbusobjects.get(path)
+			if item is None:
+				self._snapshot.pop(path, None)
+			else:
+				self._snapshot[path] = {
+					'Value': item.GetValue(),
+					'Text': item.GetText() }
+		self._dirtypaths.clear()
+		self._snapshotversion = self._version
+		return self._snapshot
+
+	# The nodes above a path, '/Ac' and '/Ac/L1' for '/Ac/L1/Power'
+	@staticmethod
+	def _ancestors(path):
+		spl = path.split('/')
+		for i in range(2, len(spl)):
+			yield '/'.join(spl[:i])
+
 	def _item_deleted(self, path):
-		self._dbusobjects.pop(path)
-		for np in list(self._dbusnodes.keys()):
-			if np != '/':
-				for ip in self._dbusobjects:
-					if ip.startswith(np + '/'):
-						break
-				else:
-					self._dbusnodes[np].__del__()
-					self._dbusnodes.pop(np)
+		if self._dbusobjects.pop(path, None) is None:
+			return  # already taken out by remove_paths
+		i = bisect_left(self._sortedpaths, path)
+		if i < len(self._sortedpaths) and self._sortedpaths[i] == path:
+			del self._sortedpaths[i]
+		self._release(path)
+
+	# Forget an item that is no longer in _dbusobjects: mark it for the snapshot and
+	# remove the nodes above it that have no items left
+	def _release(self, path):
+		self._local_changed(path)
+		for np in self._ancestors(path):
+			count = self._nodeitems[np] - 1
+			if count:
+				self._nodeitems[np] = count
+				continue
+			del self._nodeitems[np]
+			node = self._dbusnodes.pop(np, None)
+			if node is not None:
+				node.__del__()
+
+	# Remove path and all items below it in one go, e.g. remove_paths('/Ac/L2') when a
+	# phase disappears. Returns the number of items removed.
+	def remove_paths(self, path):
+		prefix = path.rstrip('/') + '/'
+		paths = self._sortedpaths
+		start = bisect_left(paths, prefix)
+		end = bisect_left(paths, prefix[:-1] + '0')
+		removed = paths[start:end]
+		del paths[start:end]
+		if path in self._dbusobjects:
+			paths.remove(path)
+			removed.append(path)
+
+		items = [self._dbusobjects.pop(p) for p in removed]
+		for p in removed:
+			self._release(p)
+		for item in items:
+			item.__del__()
+		return len(items)
 
 	def __getitem__(self, path):
 		return self._dbusobjects[path].local_get_value()
@@ -415,11 +527,13 @@ class VeDbusTreeExport(dbus.service.Object):
 		px = path
 		if not px.endswith('/'):
 			px += '/'
-		for p, item in self._service._dbusobjects.items():
-			if p.startswith(px):
-				v = item.GetText() if get_text else wrap_dbus_value(item.local_get_value())
-				r[p[len(px):]] = v
-		logging.debug(r)
+		# only the items below us, not a scan of the whole service
+		objects = self._service._dbusobjects
+		for p in self._service._subtree_paths(px):
+			item = objects[p]
+			v = item.GetText() if get_text else item.GetValue()
+			r[p[len(px):]] = v
+		logging.debug("_get_value_handler returns %d items" % len(r))
 		return r
 
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
@@ -439,14 +553,11 @@ class VeDbusRootExport(VeDbusTreeExport):
 	def ItemsChanged(self, changes):
 		pass
 
+	# Served from a snapshot that only gets the paths changed since the last call
+	# updated, between two meter readings it costs nothing
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='a{sa{sv}}')
 	def GetItems(self):
-		return {
-			path: {
-				'Value': wrap_dbus_value(item.local_get_value()),
-				'Text': item.GetText() }
-			for path, item in self._service._dbusobjects.items()
-		}
+		return self._service._items_snapshot()
 
 
 class VeDbusItemExport(dbus.service.Object):
@@ -462,9 +573,12 @@ class VeDbusItemExport(dbus.service.Object):
 	# @param callback	  Function that will be called when someone else changes the value of this VeBusItem
 	#                     over the dbus. First parameter passed to callback will be our path, second the new
 	#					  value. This callback should return True to accept the change, False to reject it.
+	# @param textpolicy	  TEXT_EAGER, TEXT_CACHED or TEXT_LAZY, when the Text is formatted.
+	# @param localchangecallback  Function called with our path whenever the value changed, from
+	#					  the application or over the dbus.
 	def __init__(self, bus, objectPath, value=None, description=None, writeable=False,
 					onchangecallback=None, gettextcallback=None, deletecallback=None,
-					valuetype=None):
+					valuetype=None, textpolicy=TEXT_EAGER, localchangecallback=None):
 		dbus.service.Object.__init__(self, bus, objectPath)
 		self._onchangecallback = onchangecallback
 		self._gettextcallback = gettextcallback
@@ -473,6 +587,12 @@ class VeDbusItemExport(dbus.service.Object):
 		self._writeable = writeable
 		self._deletecallback = deletecallback
 		self._type = valuetype
+		# with a fixed type the D-Bus wrapper is chosen once, here
+		self._wrap = typed_dbus_wrapper(valuetype) if valuetype is not None else wrap_dbus_value
+		self._textpolicy = textpolicy
+		self._localchangecallback = localchangecallback
+		# (type, value): text, with TEXT_CACHED only
+		self._textcache = {} if textpolicy == TEXT_CACHED else None
 
 	# To force immediate deregistering of this dbus object, explicitly call __del__().
 	def __del__(self):
@@ -505,8 +625,12 @@ class VeDbusItemExport(dbus.service.Object):
 			return None
 
 		self._value = newvalue
+		if self._localchangecallback is not None:
+			self._localchangecallback(self.__dbus_object_path__)
+		if self._textpolicy == TEXT_LAZY:
+			return {'Value': self._wrap(newvalue)}
 		return {
-			'Value': wrap_dbus_value(newvalue),
+			'Value': self._wrap(newvalue),
 			'Text': self.GetText()
 		}
 
@@ -564,13 +688,30 @@ class VeDbusItemExport(dbus.service.Object):
 	# @return the value when valid, and otherwise an empty array
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='v')
 	def GetValue(self):
-		return wrap_dbus_value(self._value)
+		return self._wrap(self._value)
 
 	## Dbus exported method GetText
 	# Returns the value as string of the dbus-object-path.
 	# @return text A text-value. '---' when local value is invalid
 	@dbus.service.method('com.victronenergy.BusItem', out_signature='s')
 	def GetText(self):
+		if self._textcache is None:
+			return self._format_text()
+
+		# the type is part of the key, 1, 1.0 and True are equal but have their own text
+		try:
+			key = (type(self._value), self._value)
+			text = self._textcache.get(key)
+		except TypeError:
+			# not hashable, e.g. a list
+			return self._format_text()
+		if text is None:
+			if len(self._textcache) >= TEXT_CACHE_SIZE:
+				self._textcache.clear()
+			text = self._textcache[key] = self._format_text()
+		return text
+
+	def _format_text(self):
 		if self._value is None:
 			return '---'
 